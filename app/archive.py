@@ -0,0 +1,312 @@
+"""Archive Helpers - Chunked, sealed ZIP members for encrypted backups
+
+An encrypted member is stored uncompressed (ZIP_STORED) inside a normal ZIP
+container and has the layout::
+
+    MAGIC (4 bytes) | nonce prefix (8 bytes) | frame | frame | ...
+
+where every frame is a 4-byte big-endian length followed by one
+independently deflated and AEAD-sealed chunk of the source file. Because
+frames do not depend on each other, compression and sealing run in parallel
+on the writer side, and a reader can open any member (or chunk) without
+touching the rest of the archive.
+"""
+import os
+import time
+import hashlib
+import zlib
+import re
+import struct
+import zipfile
+import tempfile
+from collections import deque
+from pathlib import Path, PurePosixPath
+from encryption import EncryptionError, NONCE_PREFIX_SIZE
+from profiler import NULL_TRACER
+from progress import NULL_PROGRESS
+
+MAGIC = b"BKE1"
+HEADER_SIZE = len(MAGIC) + NONCE_PREFIX_SIZE
+_FRAME_LEN = struct.Struct(">I")
+_DATA_DESCRIPTOR = 0x08
+_ZIP64_EXTRA = 0x0001
+RESTORE_TMP_SUFFIX = ".restore"
+# restore_member's temp names: ".<name>." + mkstemp's 8 random characters + suffix
+_RESTORE_TMP = re.compile(r"\..+\.[a-z0-9_]{8}" + re.escape(RESTORE_TMP_SUFFIX) + "$")
+
+
+def is_restore_tmp(name):
+    """True for a temp file left behind by an interrupted restore_member()"""
+    return bool(_RESTORE_TMP.match(name))
+
+
+def safe_join(root, arcname):
+    """Resolve an archive member name below root, rejecting path traversal"""
+    parts = [p for p in PurePosixPath(arcname.replace("\\", "/")).parts if p not in ("", ".", "/")]
+    if not parts or ".." in parts or parts[0].endswith(":"):
+        raise ValueError(f"Unsafe member name in archive: {arcname}")
+    return Path(root).joinpath(*parts)
+
+
+def _timed_read(f, size, tracer):
+    start = time.perf_counter()
+    data = f.read(size)
+    tracer.add("read", time.perf_counter() - start, len(data))
+    return data
+
+
+def _hash_chunk(digest, data, tracer):
+    start = time.perf_counter()
+    digest.update(data)
+    tracer.add("hash", time.perf_counter() - start, len(data))
+
+
+def _read_chunks(f, chunk_size, tracer=NULL_TRACER, digest=None):
+    """Yield (index, data, final) with one chunk of look-ahead"""
+    index = 0
+    chunk = _timed_read(f, chunk_size, tracer)
+    while True:
+        following = _timed_read(f, chunk_size, tracer) if chunk else b""
+        final = not following
+        if digest is not None:
+            _hash_chunk(digest, chunk, tracer)
+        yield index, chunk, final
+        if final:
+            return
+        index += 1
+        chunk = following
+
+
+def _read_frames(src, tracer=NULL_TRACER):
+    """Yield (index, sealed_frame, final) from an open member stream"""
+    index = 0
+    frame = _read_frame(src, tracer)
+    while frame is not None:
+        following = _read_frame(src, tracer)
+        yield index, frame, following is None
+        index += 1
+        frame = following
+
+
+def _read_frame(src, tracer):
+    start = time.perf_counter()
+    header = src.read(_FRAME_LEN.size)
+    if not header:
+        return None
+    if len(header) != _FRAME_LEN.size:
+        raise EncryptionError("Truncated frame header")
+    (length,) = _FRAME_LEN.unpack(header)
+    frame = src.read(length)
+    if len(frame) != length:
+        raise EncryptionError("Truncated frame")
+    tracer.add("read", time.perf_counter() - start, _FRAME_LEN.size + length)
+    return frame
+
+
+def compress_chunk(data, level):
+    """Raw-deflate one chunk on its own so it can be inflated independently"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush()
+
+
+def _seal_chunk(cipher, prefix, index, data, arcname, final, level, tracer):
+    with tracer.measure("compress", len(data)):
+        compressed = compress_chunk(data, level)
+    with tracer.measure("encrypt", len(compressed)):
+        return cipher.seal(prefix, index, compressed, arcname, final)
+
+
+def _open_chunk(cipher, prefix, index, frame, arcname, final, tracer):
+    with tracer.measure("decrypt", len(frame)):
+        compressed = cipher.open(prefix, index, frame, arcname, final)
+    with tracer.measure("decompress", len(compressed)):
+        return zlib.decompress(compressed, -15)
+
+
+def _ordered(executor, tasks, window):
+    """Run tasks on the executor, keeping at most `window` in flight, yielding results in order"""
+    pending = deque()
+    for fn, args in tasks:
+        pending.append(executor.submit(fn, *args))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
+
+
+def write_sealed_member(zipf, src_path, arcname, cipher, executor, window, chunk_size, level,
+                        tracer=NULL_TRACER, progress=NULL_PROGRESS):
+    """Compress and seal src_path into zipf as arcname.
+
+    Returns the manifest facts of the data actually read: {"size", "sha256"}.
+    """
+    zinfo = zipfile.ZipInfo.from_file(src_path, arcname)
+    with open(src_path, 'rb') as src:
+        return write_sealed_stream(zipf, src, zinfo, cipher, executor, window, chunk_size, level,
+                                   tracer, progress)
+
+
+def write_sealed_stream(zipf, src, zinfo, cipher, executor, window, chunk_size, level,
+                        tracer=NULL_TRACER, progress=NULL_PROGRESS, force_zip64=False):
+    """Compress and seal everything read from the binary stream src as member zinfo"""
+    zinfo.compress_type = zipfile.ZIP_STORED
+    prefix = os.urandom(NONCE_PREFIX_SIZE)
+    digest = hashlib.sha256()
+    sizes = deque()
+
+    def tasks():
+        for index, data, final in _read_chunks(src, chunk_size, tracer, digest):
+            sizes.append(len(data))
+            yield _seal_chunk, (cipher, prefix, index, data, zinfo.filename, final, level, tracer)
+
+    size = 0
+    with zipf.open(zinfo, 'w', force_zip64=force_zip64) as dst:
+        dst.write(MAGIC + prefix)
+        for frame in _ordered(executor, tasks(), window):
+            dst.write(_FRAME_LEN.pack(len(frame)))
+            dst.write(frame)
+            nbytes = sizes.popleft()
+            size += nbytes
+            progress.advance(nbytes=nbytes)
+    return {"size": size, "sha256": digest.hexdigest()}
+
+
+def write_member(zipf, src_path, arcname, timed_file, tracer=NULL_TRACER, chunk_size=1024 * 1024,
+                 progress=NULL_PROGRESS):
+    """Deflate src_path into zipf, splitting time into read, hash, compress and write.
+
+    timed_file is the profiler.TimedFile the archive is written through; its
+    elapsed disk time is subtracted from the time spent inside ZipFile.
+    Returns the manifest facts of the data actually read: {"size", "sha256"}.
+    """
+    zinfo = zipfile.ZipInfo.from_file(src_path, arcname)
+    with open(src_path, 'rb') as src:
+        return write_stream(zipf, src, zinfo, timed_file, tracer, chunk_size, progress)
+
+
+def write_stream(zipf, src, zinfo, timed_file, tracer=NULL_TRACER, chunk_size=1024 * 1024,
+                 progress=NULL_PROGRESS, force_zip64=False):
+    """Deflate everything read from the binary stream src into zipf as member zinfo"""
+    zinfo.compress_type = zipf.compression
+    digest = hashlib.sha256()
+    size = 0
+    with zipf.open(zinfo, 'w', force_zip64=force_zip64) as dst:
+        while True:
+            chunk = _timed_read(src, chunk_size, tracer)
+            if not chunk:
+                break
+            _hash_chunk(digest, chunk, tracer)
+            disk_before = timed_file.elapsed
+            start = time.perf_counter()
+            dst.write(chunk)
+            elapsed = time.perf_counter() - start - (timed_file.elapsed - disk_before)
+            tracer.add("compress", elapsed, len(chunk))
+            size += len(chunk)
+            progress.advance(nbytes=len(chunk))
+    return {"size": size, "sha256": digest.hexdigest()}
+
+
+def copy_raw_member(src_file, info, zipf, tracer=NULL_TRACER, progress=NULL_PROGRESS,
+                    chunk_size=1024 * 1024):
+    """Append a member of another archive to zipf without decompressing it.
+
+    src_file is the source archive opened 'rb' and info the member's ZipInfo
+    from that archive. The stored bytes (deflated or sealed) are copied as
+    they are behind a fresh local header; zipf writes the central directory
+    entry when it is closed. Returns the new ZipInfo.
+    """
+    src_file.seek(info.header_offset)
+    header = src_file.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader:
+        raise zipfile.BadZipFile(f"Truncated local header for {info.filename}")
+    fields = struct.unpack(zipfile.structFileHeader, header)
+    if fields[zipfile._FH_SIGNATURE] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local header for {info.filename}")
+    src_file.seek(fields[zipfile._FH_FILENAME_LENGTH] + fields[zipfile._FH_EXTRA_FIELD_LENGTH], os.SEEK_CUR)
+
+    zinfo = zipfile.ZipInfo(info.filename, info.date_time)
+    for name in ("compress_type", "create_system", "create_version", "extract_version",
+                 "internal_attr", "external_attr", "CRC", "compress_size", "file_size"):
+        setattr(zinfo, name, getattr(info, name))
+    # Sizes go in the new local header, so no data descriptor follows the data
+    zinfo.flag_bits = info.flag_bits & ~_DATA_DESCRIPTOR
+    zinfo.extra = zipfile._strip_extra(info.extra, (_ZIP64_EXTRA,))
+
+    dst = zipf.fp
+    zinfo.header_offset = dst.tell()
+    dst.write(zinfo.FileHeader())
+    remaining = info.compress_size
+    while remaining:
+        chunk = _timed_read(src_file, min(chunk_size, remaining), tracer)
+        if not chunk:
+            raise zipfile.BadZipFile(f"Truncated data for {info.filename}")
+        dst.write(chunk)
+        remaining -= len(chunk)
+        progress.advance(nbytes=len(chunk))
+    zipf.filelist.append(zinfo)
+    zipf.NameToInfo[zinfo.filename] = zinfo
+    zipf.start_dir = dst.tell()
+    return zinfo
+
+
+def iter_sealed_member(zipf, arcname, cipher, executor, window, tracer=NULL_TRACER):
+    """Yield the decrypted, decompressed chunks of a sealed member in order"""
+    with zipf.open(arcname) as src:
+        header = src.read(HEADER_SIZE)
+        if len(header) != HEADER_SIZE or not header.startswith(MAGIC):
+            raise EncryptionError(f"Not a sealed member: {arcname}")
+        prefix = header[len(MAGIC):]
+        tasks = ((_open_chunk, (cipher, prefix, index, frame, arcname, final, tracer))
+                 for index, frame, final in _read_frames(src, tracer))
+        for chunk in _ordered(executor, tasks, window):
+            yield chunk
+
+
+def iter_member(zipf, info, tracer=NULL_TRACER, chunk_size=1024 * 1024):
+    """Yield the inflated chunks of a plain member in order"""
+    with zipf.open(info) as src:
+        while True:
+            chunk = _timed_read(src, chunk_size, tracer)
+            if not chunk:
+                return
+            yield chunk
+
+
+def hash_file(path, tracer=NULL_TRACER, chunk_size=1024 * 1024):
+    """SHA-256 of a file on disk, as recorded in backup manifests"""
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        while True:
+            chunk = _timed_read(f, chunk_size, tracer)
+            if not chunk:
+                return digest.hexdigest()
+            _hash_chunk(digest, chunk, tracer)
+
+
+def restore_member(info, target, chunks, tracer=NULL_TRACER, mtime_ns=None, progress=NULL_PROGRESS):
+    """Write a member's decoded chunks to target atomically; returns the bytes written.
+
+    Data goes to a temp file next to target which is renamed over it once
+    complete, so a reader (or a crash) never sees a half-restored file.
+    """
+    target = Path(target)
+    target.parent.mkdir(parents=True, exist_ok=True)
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=f".{target.name}.",
+                               suffix=RESTORE_TMP_SUFFIX)
+    written = 0
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            for chunk in chunks:
+                with tracer.measure("write", len(chunk)):
+                    out.write(chunk)
+                written += len(chunk)
+                progress.advance(nbytes=len(chunk))
+        os.chmod(tmp, (info.external_attr >> 16) & 0o7777 or 0o644)
+        os.replace(tmp, target)
+    except BaseException:
+        if os.path.exists(tmp):
+            os.unlink(tmp)
+        raise
+    if mtime_ns is not None:
+        os.utime(target, ns=(mtime_ns, mtime_ns))
+    return written
@@ -1,11 +1,21 @@
 """Core Backup Module"""
 import os
+import time
 import zipfile
 import datetime
 import json
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from config import BACKUP_CONFIG, CLOUD_CONFIG, LOG_CONFIG
+from config import BACKUP_CONFIG, CLOUD_CONFIG, LOG_CONFIG, ENCRYPTION_CONFIG, PROFILING_CONFIG
 from cloud_simulator import CloudStorageSimulator
+from encryption import BackupCipher
+from progress import NULL_PROGRESS, JobCancelled
+import archive
+import db_sources
+import journal
+import metrics_sampler
+import profiler
+import restore_planner
 import logging
 
 logging.basicConfig(
@@ -15,40 +25,88 @@ logging.basicConfig(
 )
 
 class BackupSystem:
-    def __init__(self):
-        self.config = BACKUP_CONFIG
-        self.cloud = CloudStorageSimulator()
+    def __init__(self, config=None, cloud_config=None):
+        self.config = config or BACKUP_CONFIG
+        self.cloud = CloudStorageSimulator(cloud_config)
         self.backup_dir = Path(self.config["backup_location"])
         self.backup_dir.mkdir(parents=True, exist_ok=True)
+        self.catalog = restore_planner.BackupCatalog(self.backup_dir)
+        self.last_profile = None
+        self.throttle = metrics_sampler.BackupThrottle()
+        journal.recover_orphans(self.backup_dir, keep_resumable=self.config["resume_interrupted"])
         
-    def create_backup(self):
-        """Create a backup of all configured source directories"""
+    def create_backup(self, resume=None, incremental=None, progress=None):
+        """Create a backup of all configured source directories.
+        
+        The archive is committed through the journal (see journal.py). When
+        resume is enabled (default: BACKUP_CONFIG["resume_interrupted"]) an
+        interrupted run is continued from its last checkpoint instead of
+        starting over.
+        
+        An incremental backup (default: BACKUP_CONFIG["incremental"]) is
+        based on the latest backup of the same sources and only stores files
+        whose size or mtime changed, plus tombstones for deleted files.
+        
+        progress (a progress.Progress) receives live file and byte counts;
+        cancelling it stops the run and discards the partial archive.
+        """
+        progress = progress or NULL_PROGRESS
+        lock = None
+        backup_path = checkpoint = None
         try:
-            timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
-            backup_name = f"backup_{timestamp}.zip"
-            backup_path = self.backup_dir / backup_name
+            progress.start("starting")
+            if resume is None:
+                resume = self.config["resume_interrupted"]
+            if incremental is None:
+                incremental = self.config["incremental"]
+            checkpoint, lock = self._claim_interrupted() if resume else (None, None)
             
-            logging.info(f"Starting backup: {backup_name}")
-            print(f"📦 Creating backup: {backup_name}")
+            if checkpoint:
+                backup_name = checkpoint.state["backup_name"]
+                timestamp = checkpoint.state["timestamp"]
+                backup_path = self.backup_dir / backup_name
+                logging.info(f"Resuming interrupted backup: {backup_name}")
+                print(f"🔁 Resuming backup: {backup_name} ({checkpoint.state['total_files']} files already archived)")
+                encryption = checkpoint.state.get("encryption")
+                cipher = BackupCipher.from_metadata(encryption) if encryption else None
+                base_name = checkpoint.state.get("base_backup")
+                base_state = self._chain_state(base_name) if base_name else {}
+                checkpoint.compact()
+                tracer = profiler.RunTracer("backup", backup_name).start()
+                archive_file = profiler.TimedFile(open(journal.tmp_path(backup_path), 'r+b'), tracer)
+                zipf = journal.reopen_archive(archive_file, checkpoint, zipfile.ZIP_DEFLATED)
+            else:
+                backup_name, timestamp, lock = self._reserve_backup_name()
+                backup_path = self.backup_dir / backup_name
+                logging.info(f"Starting backup: {backup_name}")
+                print(f"📦 Creating backup: {backup_name}")
+                cipher = BackupCipher.generate() if ENCRYPTION_CONFIG["enabled"] else None
+                base_name, base_state = self._incremental_base() if incremental else (None, {})
+                if base_name:
+                    print(f"   Incremental, based on {base_name}")
+                checkpoint = journal.BackupCheckpoint.create(backup_path, {
+                    "backup_name": backup_name,
+                    "timestamp": timestamp,
+                    "source_dirs": self.config["source_dirs"],
+                    "base_backup": base_name,
+                    "encryption": cipher.metadata() if cipher else None,
+                    "total_files": 0,
+                    "total_size": 0,
+                })
+                tracer = profiler.RunTracer("backup", backup_name).start()
+                archive_file = profiler.TimedFile(open(journal.tmp_path(backup_path), 'w+b'), tracer)
+                zipf = zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED)
             
             # Create ZIP file
-            total_files = 0
-            total_size = 0
+            with archive_file:
+                with zipf, ThreadPoolExecutor(max_workers=ENCRYPTION_CONFIG["workers"]) as executor:
+                    total_files, total_size, seen = self._archive_sources(
+                        zipf, archive_file, checkpoint, cipher, executor, tracer, base_state, progress)
+                with tracer.span("fsync"):
+                    journal.fsync_file(archive_file)
             
-            with zipfile.ZipFile(backup_path, 'w', zipfile.ZIP_DEFLATED) as zipf:
-                for source_dir in self.config["source_dirs"]:
-                    source_path = Path(source_dir)
-                    if not source_path.exists():
-                        logging.warning(f"Source directory not found: {source_dir}")
-                        continue
-                    
-                    for root, dirs, files in os.walk(source_path):
-                        for file in files:
-                            file_path = Path(root) / file
-                            arcname = file_path.relative_to(source_path.parent)
-                            zipf.write(file_path, arcname)
-                            total_files += 1
-                            total_size += file_path.stat().st_size
+            # Files that existed as of the base backup but are gone now
+            deleted = sorted(set(base_state) - seen)
             
             # Create metadata
             metadata = {
@@ -59,15 +117,25 @@ class BackupSystem:
                 "total_size_mb": round(total_size / (1024 * 1024), 2),
                 "source_dirs": self.config["source_dirs"],
                 "compression": self.config["compression"],
+                "backup_type": "incremental" if base_name else "full",
+                "base_backup": base_name,
+                "deleted_files": len(deleted),
+                "manifest": journal.manifest_path(backup_path).name,
             }
+            if cipher:
+                metadata["encryption"] = dict(cipher.metadata(),
+                                              format=archive.MAGIC.decode(),
+                                              chunk_size_kb=ENCRYPTION_CONFIG["chunk_size_kb"])
             
-            # Save metadata
-            metadata_path = self.backup_dir / f"{backup_name}.meta"
-            with open(metadata_path, 'w') as f:
-                json.dump(metadata, f, indent=2)
+            progress.check_cancelled()
+            progress.set_phase("committing")
+            self._commit_run(backup_path, checkpoint, metadata, checkpoint.files, deleted, tracer)
             
             # Simulate cloud upload
-            upload_success = self.cloud.upload_backup(backup_path, metadata)
+            progress.set_phase("uploading")
+            with tracer.span("upload", bytes=backup_path.stat().st_size):
+                upload_success = self.cloud.upload_backup(backup_path, metadata)
+            self._finish_profile(tracer, backup_path, files=total_files, bytes=total_size)
             
             if upload_success:
                 logging.info(f"Backup completed successfully: {backup_name}")
@@ -77,10 +145,395 @@ class BackupSystem:
                 logging.error(f"Cloud upload failed for: {backup_name}")
                 return False, backup_name, metadata
                 
+        except JobCancelled:
+            logging.warning(f"Backup cancelled: {backup_path.name if backup_path else 'not started'}")
+            print("🛑 Backup cancelled")
+            if backup_path:
+                self._discard_run(backup_path, checkpoint)
+            return False, None, None
         except Exception as e:
             logging.error(f"Backup failed: {str(e)}")
             print(f"❌ Backup failed: {str(e)}")
             return False, None, None
+        finally:
+            if lock:
+                lock.release()
+    
+    def synthesize_full_backup(self, backup_name=None, progress=None):
+        """Build a full backup out of the archives already in the backup directory.
+        
+        The state as of backup_name (default: the latest backup of the current
+        sources) is resolved through its chain, and every file's stored bytes
+        are copied from the archive holding its latest version - without
+        decompressing them or reading the sources. The new archive is
+        committed like any other backup and starts a fresh chain. Its
+        timestamp is that of backup_name, the point in time its data is from;
+        synthesized_at records when it was built. Encrypted
+        members keep their original data keys; the manifest records each
+        entry's key_id and .meta carries all the wrapped keys.
+        """
+        progress = progress or NULL_PROGRESS
+        lock = None
+        backup_path = checkpoint = None
+        try:
+            progress.start("planning")
+            if backup_name is None:
+                candidates = [m for m in self.list_backups() if m.get("source_dirs") == self.config["source_dirs"]]
+                if not candidates:
+                    raise ValueError("No backup of the configured sources to synthesize from")
+                backup_name = candidates[0]["backup_name"]
+            source_meta = self.catalog.load_meta(backup_name)
+            plan = restore_planner.plan_restore(self.catalog, backup_name)
+            owners = plan.by_archive()
+            encryption = self._merged_encryption(plan.chain, owners)
+            
+            new_name, synthesized_at, lock = self._reserve_backup_name()
+            # The data is as of the source backup: ordering, "latest" and RPO go by that point
+            timestamp = source_meta.get("timestamp", synthesized_at)
+            backup_path = self.backup_dir / new_name
+            logging.info(f"Synthesizing full backup {new_name} from {backup_name}")
+            print(f"🧩 Synthesizing full backup: {new_name} from {backup_name} "
+                  f"({len(plan.chain)} archives in chain)")
+            checkpoint = journal.BackupCheckpoint.create(backup_path, {
+                "backup_name": new_name,
+                "timestamp": timestamp,
+                "source_dirs": source_meta.get("source_dirs", self.config["source_dirs"]),
+                "base_backup": None,
+                "synthesized_from": backup_name,
+                "synthesized_at": synthesized_at,
+                "encryption": encryption,
+                "total_files": 0,
+                "total_size": 0,
+                # Cheap to redo from the source archives, so never resumed
+                "resumable": False,
+            })
+            tracer = profiler.RunTracer("synthesize", new_name).start()
+            
+            # Members of each source archive are copied in on-disk order
+            sources = []
+            with tracer.span("plan"):
+                for owner in sorted(owners):
+                    owner_encryption = self.catalog.load_meta(owner).get("encryption")
+                    with self.catalog.open_archive(owner) as f, zipfile.ZipFile(f, 'r') as src:
+                        members = sorted(((src.getinfo(arcname), arcname, entry) for arcname, entry in owners[owner]),
+                                         key=lambda member: member[0].header_offset)
+                    sources.append((owner, owner_encryption, members))
+            progress.set_totals(len(plan), sum(info.compress_size for _, _, members in sources
+                                               for info, _, _ in members))
+            progress.set_phase("copying")
+            
+            files = {}
+            archive_file = profiler.TimedFile(open(journal.tmp_path(backup_path), 'w+b'), tracer)
+            with archive_file:
+                with zipfile.ZipFile(archive_file, 'w', zipfile.ZIP_DEFLATED) as zipf:
+                    for owner, owner_encryption, members in sources:
+                        with self.catalog.open_archive(owner) as src_file:
+                            for info, arcname, entry in members:
+                                with tracer.file_span(arcname, info.compress_size):
+                                    archive.copy_raw_member(src_file, info, zipf, tracer, progress)
+                                entry = dict(entry)
+                                if encryption:
+                                    entry["key_id"] = restore_planner.entry_key_id(owner_encryption, entry)
+                                files[arcname] = entry
+                                progress.advance(files=1, current=arcname)
+                with tracer.span("fsync"):
+                    journal.fsync_file(archive_file)
+            
+            total_size = sum(entry.get("size") or 0 for entry in files.values())
+            metadata = {
+                "backup_name": new_name,
+                "timestamp": timestamp,
+                "total_files": len(files),
+                "total_size_bytes": total_size,
+                "total_size_mb": round(total_size / (1024 * 1024), 2),
+                "source_dirs": checkpoint.state["source_dirs"],
+                "compression": self.config["compression"],
+                "backup_type": "full",
+                "base_backup": None,
+                "deleted_files": 0,
+                "manifest": journal.manifest_path(backup_path).name,
+                "synthesized_from": backup_name,
+                "synthesized_at": synthesized_at,
+            }
+            if encryption:
+                metadata["encryption"] = encryption
+            
+            progress.check_cancelled()
+            progress.set_phase("committing")
+            self._commit_run(backup_path, checkpoint, metadata, files, [], tracer)
+            
+            progress.set_phase("uploading")
+            with tracer.span("upload", bytes=backup_path.stat().st_size):
+                upload_success = self.cloud.upload_backup(backup_path, metadata)
+            self._finish_profile(tracer, backup_path, files=len(files), bytes=total_size,
+                                 chain_length=len(plan.chain))
+            
+            if upload_success:
+                logging.info(f"Synthetic full backup completed: {new_name}")
+                print(f"✅ Synthetic full backup completed: {len(files)} files, {metadata['total_size_mb']} MB")
+                return True, new_name, metadata
+            logging.error(f"Cloud upload failed for: {new_name}")
+            return False, new_name, metadata
+        
+        except JobCancelled:
+            logging.warning(f"Synthetic full backup cancelled: {backup_path.name if backup_path else 'not started'}")
+            print("🛑 Synthetic full backup cancelled")
+            if backup_path:
+                self._discard_run(backup_path, checkpoint)
+            return False, None, None
+        except Exception as e:
+            logging.error(f"Synthetic full backup failed: {str(e)}")
+            print(f"❌ Synthetic full backup failed: {str(e)}")
+            if backup_path and journal.tmp_path(backup_path).exists():
+                self._discard_run(backup_path, checkpoint)
+            return False, None, None
+        finally:
+            if lock:
+                lock.release()
+    
+    def _merged_encryption(self, chain, owners):
+        """Encryption block for an archive holding members of several encrypted archives"""
+        blocks = [self.catalog.load_meta(name).get("encryption") for name in chain if name in owners]
+        blocks = [block for block in blocks if block]
+        if not blocks:
+            return None
+        kek_ids = {block["kek_id"] for block in blocks}
+        if len(kek_ids) > 1:
+            raise ValueError(f"Source archives use different master keys: {', '.join(sorted(kek_ids))}")
+        merged = dict(blocks[-1], wrapped_keys={})
+        for block in blocks:
+            merged["wrapped_keys"].update(block["wrapped_keys"])
+        return merged
+    
+    def _commit_run(self, backup_path, checkpoint, metadata, files, deleted, tracer):
+        """Commit: manifest, then the archive, then .meta as the commit marker"""
+        with tracer.span("commit"):
+            journal.atomic_write_json(journal.manifest_path(backup_path), {
+                "backup_name": metadata["backup_name"],
+                "base_backup": metadata["base_backup"],
+                "files": files,
+                "deleted": deleted,
+            }, indent=None)
+            checkpoint.commit(metadata)
+            journal.commit_file(journal.tmp_path(backup_path), backup_path)
+            journal.atomic_write_json(self.backup_dir / f"{backup_path.name}.meta", metadata)
+            checkpoint.remove()
+    
+    def _archive_sources(self, zipf, archive_file, checkpoint, cipher, executor, tracer, base_state,
+                         progress=NULL_PROGRESS):
+        """Add every new or changed source file not yet in the checkpoint.
+        
+        The sources are scanned first so progress has totals to estimate from.
+        With BACKUP_CONFIG["include_db"] set, a snapshot of every database in
+        DB_CONFIG is added as well. Between files the throttle may pause the
+        run while the host is busy (METRICS_CONFIG["throttle"]).
+        Returns (files archived, bytes archived, every arcname seen).
+        """
+        done = {entry["filename"] for entry in checkpoint.entries}
+        counters = {"total_files": checkpoint.state["total_files"], "total_size": checkpoint.state["total_size"]}
+        interval_files = self.config["checkpoint_interval_files"]
+        interval_bytes = self.config["checkpoint_interval_mb"] * 1024 * 1024
+        pending = {"files": 0, "bytes": 0, "manifest": {}}
+        
+        def add(arcname, entry):
+            pending["manifest"][arcname] = entry
+            counters["total_files"] += 1
+            counters["total_size"] += entry["size"]
+            pending["files"] += 1
+            pending["bytes"] += entry["size"]
+            progress.advance(files=1, current=arcname)
+            if pending["files"] >= interval_files or pending["bytes"] >= interval_bytes:
+                with tracer.span("checkpoint"):
+                    checkpoint.record(zipf, dict(counters), pending["manifest"])
+                tracer.counters()
+                pending.update(files=0, bytes=0, manifest={})
+        
+        progress.set_phase("scanning")
+        seen, todo = self._scan_sources(done, base_state, tracer, progress)
+        databases = db_sources.configured_sources() if self.config["include_db"] else []
+        seen.update(source.arcname for source in databases)
+        databases = [source for source in databases if source.arcname not in done]
+        progress.set_totals(counters["total_files"] + len(todo) + len(databases),
+                            counters["total_size"] + sum(stat.st_size for _, _, stat in todo)
+                            + sum(source.size_hint() or 0 for source in databases),
+                            files_done=counters["total_files"], bytes_done=counters["total_size"])
+        progress.set_phase("archiving")
+        
+        for file_path, arcname, stat in todo:
+            self.throttle.pause(progress, tracer)
+            with tracer.file_span(arcname, stat.st_size):
+                if cipher:
+                    entry = self._write_sealed(zipf, file_path, arcname, cipher, executor, tracer, progress)
+                else:
+                    entry = archive.write_member(zipf, file_path, arcname, archive_file, tracer,
+                                                 progress=progress)
+            entry["mtime_ns"] = stat.st_mtime_ns
+            add(arcname, entry)
+        
+        for source in databases:
+            self.throttle.pause(progress, tracer)
+            progress.set_phase("archiving databases", current=source.arcname)
+            add(source.arcname, self._write_database(zipf, archive_file, source, cipher, executor, tracer,
+                                                     progress))
+        
+        with tracer.span("checkpoint"):
+            checkpoint.record(zipf, dict(counters), pending["manifest"])
+        return counters["total_files"], counters["total_size"], seen
+    
+    def _write_database(self, zipf, archive_file, source, cipher, executor, tracer, progress=NULL_PROGRESS):
+        """Stream a consistent snapshot of a database into the archive"""
+        taken_ns = time.time_ns()
+        zinfo = zipfile.ZipInfo(source.arcname, time.localtime(taken_ns // 1_000_000_000)[:6])
+        zinfo.external_attr = 0o600 << 16
+        size_hint = source.size_hint()
+        # A snapshot (SQL dumps especially) can outgrow its hint; only a clearly small one skips ZIP64
+        force_zip64 = size_hint is None or size_hint > zipfile.ZIP64_LIMIT // 4
+        logging.info(f"Snapshotting database {source.name} ({source.engine})")
+        with source.snapshot(tracer, progress) as stream, tracer.file_span(source.arcname, size_hint or 0):
+            if cipher:
+                entry = archive.write_sealed_stream(
+                    zipf, stream, zinfo, cipher, executor,
+                    window=2 * ENCRYPTION_CONFIG["workers"],
+                    chunk_size=ENCRYPTION_CONFIG["chunk_size_kb"] * 1024,
+                    level=ENCRYPTION_CONFIG["compression_level"],
+                    tracer=tracer, progress=progress, force_zip64=force_zip64)
+            else:
+                entry = archive.write_stream(zipf, stream, zinfo, archive_file, tracer, progress=progress,
+                                             force_zip64=force_zip64)
+        entry["mtime_ns"] = taken_ns
+        entry["database"] = source.engine
+        return entry
+    
+    def _scan_sources(self, done, base_state, tracer, progress=NULL_PROGRESS):
+        """Walk the sources: (every arcname seen, [(path, arcname, stat)] still to archive)"""
+        seen = set()
+        todo = []
+        for source_dir in self.config["source_dirs"]:
+            source_path = Path(source_dir)
+            if not source_path.exists():
+                logging.warning(f"Source directory not found: {source_dir}")
+                continue
+            
+            for root, dirs, files in self._walk(source_path, tracer):
+                progress.check_cancelled()
+                for file in files:
+                    if archive.is_restore_tmp(file):
+                        # Left by an interrupted in-place restore, not user data
+                        logging.warning(f"Skipping restore temp file: {Path(root) / file}")
+                        continue
+                    file_path = Path(root) / file
+                    arcname = file_path.relative_to(source_path.parent).as_posix()
+                    seen.add(arcname)
+                    if arcname in done:
+                        continue
+                    with tracer.measure("stat"):
+                        stat = file_path.stat()
+                    previous = base_state.get(arcname)
+                    if (previous and previous.get("size") == stat.st_size
+                            and previous.get("mtime_ns") == stat.st_mtime_ns):
+                        continue
+                    todo.append((file_path, arcname, stat))
+        return seen, todo
+    
+    def _incremental_base(self):
+        """Latest backup of the same sources to base an incremental on.
+        
+        Returns (base name, {arcname: manifest entry} as of that backup), or
+        (None, {}) when a full backup is due.
+        """
+        for metadata in self.list_backups():
+            if metadata.get("source_dirs") != self.config["source_dirs"]:
+                continue
+            backup_name = metadata["backup_name"]
+            if not metadata.get("manifest"):
+                return None, {}
+            try:
+                chain = self.catalog.chain(backup_name)
+            except restore_planner.ChainError as e:
+                logging.warning(f"Not basing incremental on {backup_name}: {e}")
+                return None, {}
+            if len(chain) >= self.config["full_backup_every"]:
+                return None, {}
+            return backup_name, self._chain_state(backup_name)
+        return None, {}
+    
+    def _chain_state(self, backup_name):
+        chain, owners = restore_planner.resolve_state(self.catalog, backup_name)
+        return {arcname: entry for arcname, (owner, entry) in owners.items()}
+    
+    @staticmethod
+    def _walk(source_path, tracer):
+        """os.walk, with the time spent listing directories attributed to the walk phase"""
+        walker = os.walk(source_path)
+        while True:
+            with tracer.measure("walk"):
+                entry = next(walker, None)
+            if entry is None:
+                return
+            yield entry
+    
+    def _finish_profile(self, tracer, backup_path, **totals):
+        """Close the run's tracer and write its trace next to the .meta"""
+        summary = tracer.finish(**totals)
+        if PROFILING_CONFIG["write_trace"]:
+            tracer.write_trace(profiler.trace_path(backup_path))
+        self.last_profile = summary
+        for line in profiler.format_summary(summary):
+            logging.info(line)
+        return summary
+    
+    def _reserve_backup_name(self):
+        """Pick an unused timestamped name and lock it for this run"""
+        timestamp = datetime.datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
+        stamp = timestamp
+        for attempt in range(1, 1000):
+            backup_path = self.backup_dir / f"backup_{stamp}.zip"
+            in_use = (backup_path.exists() or journal.tmp_path(backup_path).exists()
+                      or journal.checkpoint_path(backup_path).exists())
+            if not in_use:
+                lock = journal.RunLock(journal.lock_path(backup_path))
+                if lock.acquire():
+                    return backup_path.name, stamp, lock
+            stamp = f"{timestamp}_{attempt}"
+        raise RuntimeError(f"No free backup name for {timestamp}")
+    
+    @staticmethod
+    def _discard_run(backup_path, checkpoint):
+        """Remove the partial archive and journal of a cancelled run"""
+        journal.tmp_path(backup_path).unlink(missing_ok=True)
+        journal.manifest_path(backup_path).unlink(missing_ok=True)
+        if checkpoint:
+            checkpoint.remove()
+    
+    def _claim_interrupted(self):
+        """Lock the newest resumable run of the current source set, if any"""
+        report = journal.recover_orphans(self.backup_dir)
+        for name in sorted(report["resumable"], reverse=True):
+            backup_path = self.backup_dir / name
+            lock = journal.RunLock(journal.lock_path(backup_path))
+            if not lock.acquire():
+                continue
+            try:
+                checkpoint = journal.BackupCheckpoint.load(backup_path)
+                if (checkpoint.state.get("source_dirs") == self.config["source_dirs"]
+                        and checkpoint.state.get("resumable", True)
+                        and journal.tmp_path(backup_path).exists()):
+                    return checkpoint, lock
+            except (OSError, ValueError):
+                pass
+            lock.release(remove=False)
+        return None, None
+    
+    def _write_sealed(self, zipf, file_path, arcname, cipher, executor, tracer, progress=NULL_PROGRESS):
+        """Add a file as independently compressed and sealed chunks"""
+        return archive.write_sealed_member(
+            zipf, file_path, arcname, cipher, executor,
+            window=2 * ENCRYPTION_CONFIG["workers"],
+            chunk_size=ENCRYPTION_CONFIG["chunk_size_kb"] * 1024,
+            level=ENCRYPTION_CONFIG["compression_level"],
+            tracer=tracer,
+            progress=progress,
+        )
     
     def list_backups(self):
         """List all available backups"""
@@ -92,7 +545,7 @@ class BackupSystem:
                     with open(metadata_file, 'r') as f:
                         metadata = json.load(f)
                     backups.append(metadata)
-            return sorted(backups, key=lambda x: x["timestamp"], reverse=True)
+            return sorted(backups, key=journal.backup_order, reverse=True)
         except Exception as e:
             logging.error(f"Failed to list backups: {str(e)}")
             return []
@@ -0,0 +1,307 @@
+"""Cloud Reader - Ranged, cached reads of backup archives in cloud storage
+
+A restore from the cloud never downloads whole archives. An archive is read
+through a seekable file object backed by fixed-size blocks, which come from
+an on-disk LRU cache shared by all runs or else from ranged downloads. ZIP
+keeps its directory at the end of the file, so opening an archive costs a
+block or two; before extracting, the restore prefetches exactly the byte
+ranges of the members it needs, coalescing adjacent blocks into larger
+range requests that are issued in parallel.
+"""
+import io
+import os
+import json
+import hashlib
+import tempfile
+import threading
+import zipfile
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+from pathlib import Path
+from config import CLOUD_CONFIG
+import journal
+import restore_planner
+
+BLOCK_SUFFIX = ".blk"
+
+
+class BlockCache:
+    """On-disk LRU of downloaded blocks.
+
+    Recency survives restarts through the files' mtimes, so a repeated
+    restore in a new process still finds its blocks.
+    """
+
+    def __init__(self, path, max_bytes):
+        self.path = Path(path)
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._index = OrderedDict()
+        self._size = 0
+        for tmp in self.path.glob(f".*{journal.TMP_SUFFIX}"):
+            tmp.unlink(missing_ok=True)
+        blocks = []
+        for block in self.path.glob(f"*{BLOCK_SUFFIX}"):
+            try:
+                stat = block.stat()
+            except FileNotFoundError:
+                continue
+            blocks.append((stat.st_mtime_ns, block.name, stat.st_size))
+        for _, name, size in sorted(blocks):
+            self._index[name] = size
+            self._size += size
+
+    @staticmethod
+    def key(blob_name, etag, index):
+        digest = hashlib.sha256(f"{blob_name}\0{etag}\0{index}".encode()).hexdigest()
+        return digest[:40] + BLOCK_SUFFIX
+
+    def contains(self, key):
+        with self._lock:
+            return key in self._index
+
+    def get(self, key):
+        try:
+            with open(self.path / key, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self._lock:
+                self._size -= self._index.pop(key, 0)
+            return None
+        with self._lock:
+            self.hits += 1
+            if key in self._index:
+                self._index.move_to_end(key)
+        try:
+            os.utime(self.path / key)
+        except OSError:
+            pass
+        return data
+
+    def record_misses(self, count):
+        with self._lock:
+            self.misses += count
+
+    def put(self, key, data):
+        fd, tmp = tempfile.mkstemp(dir=self.path, prefix=f".{key}.", suffix=journal.TMP_SUFFIX)
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(tmp, self.path / key)
+        evicted = []
+        with self._lock:
+            self._size += len(data) - self._index.pop(key, 0)
+            self._index[key] = len(data)
+            while self._size > self.max_bytes and len(self._index) > 1:
+                name, size = self._index.popitem(last=False)
+                self._size -= size
+                evicted.append(name)
+        for name in evicted:
+            (self.path / name).unlink(missing_ok=True)
+
+
+class CloudBlob:
+    """One blob split into blocks; concurrent readers share every download"""
+
+    def __init__(self, cloud, blob_name, cache, executor, config):
+        props = cloud.get_blob_properties(blob_name)
+        self.cloud = cloud
+        self.name = blob_name
+        self.size = props["size_bytes"]
+        self.etag = props["etag"]
+        self.cache = cache
+        self.executor = executor
+        self.block_size = config["download_block_kb"] * 1024
+        self.request_blocks = max(1, config["download_request_mb"] * 1024 * 1024 // self.block_size)
+        self.prefetch_blocks = max(1, config["prefetch_mb"] * 1024 * 1024 // self.block_size)
+        self._inflight = {}
+        self._lock = threading.Lock()
+        self._extents = None
+        self._extents_lock = threading.Lock()
+
+    @property
+    def block_count(self):
+        return -(-self.size // self.block_size)
+
+    def _key(self, index):
+        return BlockCache.key(self.name, self.etag, index)
+
+    def block(self, index):
+        """Contents of one block, waiting for or starting its download"""
+        while True:
+            with self._lock:
+                future = self._inflight.get(index)
+            if future is not None:
+                return future.result()
+            if self.cache.contains(self._key(index)):
+                data = self.cache.get(self._key(index))
+                if data is not None:
+                    return data
+            # Read ahead one request's worth: a miss is usually followed by the next block
+            self.fetch(range(index, min(index + self.request_blocks, self.block_count)))
+
+    def prefetch(self, extents):
+        """Start downloading the blocks covering (start, end) byte ranges, up to the prefetch limit"""
+        indices = set()
+        for start, end in extents:
+            if end > start:
+                indices.update(range(start // self.block_size, (end - 1) // self.block_size + 1))
+        self.fetch(sorted(indices)[:self.prefetch_blocks])
+
+    def member_extents(self):
+        """{arcname: (start, end)} byte range of each ZIP member, read from the directory once"""
+        with self._extents_lock:
+            if self._extents is None:
+                with self.open() as f, zipfile.ZipFile(f, 'r') as zipf:
+                    infos = sorted(zipf.infolist(), key=lambda info: info.header_offset)
+                    end_of_data = zipf.start_dir
+                # A member's local header and data end where the next member begins
+                self._extents = {}
+                for info, following in zip(infos, infos[1:] + [None]):
+                    self._extents[info.filename] = (info.header_offset,
+                                                    following.header_offset if following else end_of_data)
+            return self._extents
+
+    def fetch(self, indices):
+        """Download the given blocks that are neither cached nor in flight, in coalesced ranges"""
+        claimed = []
+        with self._lock:
+            for index in sorted(set(indices)):
+                if index in self._inflight or self.cache.contains(self._key(index)):
+                    continue
+                self._inflight[index] = Future()
+                claimed.append(index)
+        self.cache.record_misses(len(claimed))
+        run = []
+        for index in claimed:
+            if run and (index != run[-1] + 1 or len(run) >= self.request_blocks):
+                self.executor.submit(self._download, run)
+                run = []
+            run.append(index)
+        if run:
+            self.executor.submit(self._download, run)
+
+    def _download(self, run):
+        start = run[0] * self.block_size
+        end = min(self.size, (run[-1] + 1) * self.block_size)
+        try:
+            data = self.cloud.download_blob(self.name, start, end - start)
+            if len(data) != end - start:
+                raise IOError(f"Short read from blob {self.name} at {start}")
+        except BaseException as e:
+            with self._lock:
+                futures = [self._inflight.pop(index) for index in run]
+            for future in futures:
+                future.set_exception(e)
+            return
+        for position, index in enumerate(run):
+            block = data[position * self.block_size:(position + 1) * self.block_size]
+            try:
+                self.cache.put(self._key(index), block)
+            except OSError:
+                pass  # an uncacheable block is still handed to its readers
+            with self._lock:
+                future = self._inflight.pop(index)
+            future.set_result(block)
+
+    def open(self):
+        """Buffered, seekable file object over the blob"""
+        return io.BufferedReader(RangeReader(self), buffer_size=self.block_size)
+
+
+class RangeReader(io.RawIOBase):
+    """Raw file object reading a CloudBlob block by block"""
+
+    def __init__(self, blob):
+        self.blob = blob
+        self._pos = 0
+        self._current = (None, b"")
+
+    def readable(self):
+        return True
+
+    def seekable(self):
+        return True
+
+    def tell(self):
+        return self._pos
+
+    def seek(self, offset, whence=io.SEEK_SET):
+        if whence == io.SEEK_SET:
+            position = offset
+        elif whence == io.SEEK_CUR:
+            position = self._pos + offset
+        elif whence == io.SEEK_END:
+            position = self.blob.size + offset
+        else:
+            raise ValueError(f"Invalid whence: {whence}")
+        if position < 0:
+            raise ValueError("Negative seek position")
+        self._pos = position
+        return position
+
+    def readinto(self, buffer):
+        if self._pos >= self.blob.size:
+            return 0
+        index, offset = divmod(self._pos, self.blob.block_size)
+        if self._current[0] != index:
+            self._current = (index, self.blob.block(index))
+        data = self._current[1]
+        n = min(len(buffer), len(data) - offset)
+        buffer[:n] = data[offset:offset + n]
+        self._pos += n
+        return n
+
+
+class CloudCatalog(restore_planner.BackupCatalog):
+    """Backup catalog served from cloud storage instead of the local backup directory"""
+
+    def __init__(self, cloud, config=None):
+        self.cloud = cloud
+        self.config = config or CLOUD_CONFIG
+        self.backup_dir = None
+        self._manifests = {}
+        self._blobs = {}
+        self._lock = threading.Lock()
+        self.cache = BlockCache(self.config["block_cache_path"], self.config["block_cache_mb"] * 1024 * 1024)
+        self._executor = ThreadPoolExecutor(max_workers=self.config["download_workers"],
+                                            thread_name_prefix="download")
+        self._requests_before = dict(cloud.download_stats)
+
+    def exists(self, backup_name):
+        return self.cloud.blob_exists(backup_name)
+
+    def _blob(self, backup_name):
+        with self._lock:
+            if backup_name not in self._blobs:
+                self._blobs[backup_name] = CloudBlob(self.cloud, backup_name, self.cache,
+                                                     self._executor, self.config)
+            return self._blobs[backup_name]
+
+    def open_archive(self, backup_name):
+        return self._blob(backup_name).open()
+
+    def _read_json(self, filename):
+        if not self.cloud.blob_exists(filename):
+            return None
+        return json.loads(self.cloud.download_blob(filename))
+
+    def prefetch(self, backup_name, arcnames):
+        """Start downloading exactly the byte ranges of these members"""
+        blob = self._blob(backup_name)
+        extents = blob.member_extents()
+        blob.prefetch([extents[arcname] for arcname in arcnames if arcname in extents])
+
+    def stats(self):
+        return {
+            "source": "cloud",
+            "range_requests": self.cloud.download_stats["requests"] - self._requests_before["requests"],
+            "downloaded_bytes": self.cloud.download_stats["bytes"] - self._requests_before["bytes"],
+            "cache_hits": self.cache.hits,
+            "cache_misses": self.cache.misses,
+        }
+
+    def close(self):
+        self._executor.shutdown(wait=True)
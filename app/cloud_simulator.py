@@ -1,8 +1,14 @@
 """Cloud Storage Simulator - Simulates Azure Blob Storage locally"""
+import os
 import json
+import time
+import shutil
+import tempfile
+import threading
 from pathlib import Path
 from datetime import datetime
 from config import CLOUD_CONFIG, LOG_CONFIG
+from journal import atomic_write_json, backup_order
 import logging
 
 logging.basicConfig(
@@ -14,11 +20,18 @@ logging.basicConfig(
 class CloudStorageSimulator:
     """Simulates cloud storage operations locally"""
     
-    def __init__(self):
-        self.config = CLOUD_CONFIG
+    # Serializes read-modify-write of the metadata file across instances in this process
+    _metadata_lock = threading.Lock()
+    
+    def __init__(self, config=None):
+        self.config = config or CLOUD_CONFIG
         self.storage_path = Path(self.config["local_storage_path"])
         self.container_name = self.config["container_name"]
         self.metadata_file = self.storage_path / "cloud_metadata.json"
+        self.container_path = Path(self.config["blob_storage_path"]) / self.container_name
+        self.download_stats = {"requests": 0, "bytes": 0}
+        self._stats_lock = threading.Lock()
+        self.storage_path.mkdir(parents=True, exist_ok=True)
         self._load_metadata()
     
     def _load_metadata(self):
@@ -36,16 +49,25 @@ class CloudStorageSimulator:
             self._save_metadata()
     
     def _save_metadata(self):
-        """Save cloud storage metadata"""
-        with open(self.metadata_file, 'w') as f:
-            json.dump(self.metadata, f, indent=2)
+        """Save cloud storage metadata (write-and-rename, never truncated in place)"""
+        atomic_write_json(self.metadata_file, self.metadata)
     
     def upload_backup(self, backup_path, backup_metadata):
-        """Simulate uploading backup to cloud storage"""
+        """Simulate uploading backup to cloud storage.
+        
+        The archive is stored as a blob in the container, together with its
+        .meta and manifest, so it can be restored after the local copy is lost.
+        """
         try:
             backup_path = Path(backup_path)
             logging.info(f"Simulating cloud upload: {backup_path.name}")
             
+            # Metadata blobs go last: a blob set is complete once its .meta exists
+            self._put_blob(backup_path)
+            for companion in (Path(f"{backup_path}.manifest.json"), Path(f"{backup_path}.meta")):
+                if companion.exists():
+                    self._put_blob(companion, mode="copy")
+            
             blob_info = {
                 "blob_name": backup_path.name,
                 "size_bytes": backup_path.stat().st_size,
@@ -54,14 +76,95 @@ class CloudStorageSimulator:
                 "metadata": backup_metadata
             }
             
-            self.metadata["blobs"].append(blob_info)
-            self._save_metadata()
+            with self._metadata_lock:
+                # Reload first: another instance may have uploaded since this one was created
+                self._load_metadata()
+                self.metadata["blobs"].append(blob_info)
+                self._save_metadata()
             logging.info(f"Cloud upload simulated successfully: {backup_path.name}")
             return True
         except Exception as e:
             logging.error(f"Cloud upload simulation failed: {str(e)}")
             return False
     
+    def _put_blob(self, path, mode=None):
+        """Store a file in the container (link or copy, then atomic rename)"""
+        self.container_path.mkdir(parents=True, exist_ok=True)
+        fd, tmp = tempfile.mkstemp(dir=self.container_path, prefix=f".{path.name}.", suffix=".upload")
+        os.close(fd)
+        try:
+            if (mode or self.config["upload_mode"]) == "hardlink":
+                try:
+                    os.unlink(tmp)
+                    os.link(path, tmp)
+                except OSError:
+                    # e.g. the container is on another filesystem
+                    shutil.copyfile(path, tmp)
+            else:
+                shutil.copyfile(path, tmp)
+            os.replace(tmp, self.container_path / path.name)
+        except BaseException:
+            if os.path.exists(tmp):
+                os.unlink(tmp)
+            raise
+    
+    def _blob_path(self, blob_name):
+        path = self.container_path / blob_name
+        if Path(blob_name).name != blob_name or not path.is_file():
+            raise FileNotFoundError(f"Blob not found: {blob_name}")
+        return path
+    
+    def blob_exists(self, blob_name):
+        try:
+            self._blob_path(blob_name)
+            return True
+        except FileNotFoundError:
+            return False
+    
+    def get_blob_properties(self, blob_name):
+        """Size and etag of a stored blob; the etag changes whenever the blob is replaced"""
+        stat = self._blob_path(blob_name).stat()
+        return {
+            "blob_name": blob_name,
+            "size_bytes": stat.st_size,
+            "etag": f"{stat.st_ino:x}-{stat.st_mtime_ns:x}-{stat.st_size:x}",
+            "last_modified": datetime.fromtimestamp(stat.st_mtime).isoformat(),
+        }
+    
+    def download_blob(self, blob_name, offset=0, length=None):
+        """Download a blob, or the byte range [offset, offset + length) of it.
+        
+        Each request pays the configured latency, and its bytes flow at the
+        configured per-request bandwidth.
+        """
+        path = self._blob_path(blob_name)
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            data = f.read() if length is None else f.read(length)
+        delay = self.config["download_latency_ms"] / 1000.0
+        if self.config["download_bandwidth_mb_s"]:
+            delay += len(data) / (self.config["download_bandwidth_mb_s"] * 1024 * 1024)
+        time.sleep(delay)
+        with self._stats_lock:
+            self.download_stats["requests"] += 1
+            self.download_stats["bytes"] += len(data)
+        return data
+    
+    def list_container(self, prefix=""):
+        """Names of the blobs stored in the container"""
+        if not self.container_path.exists():
+            return []
+        return sorted(path.name for path in self.container_path.iterdir()
+                      if path.is_file() and path.name.startswith(prefix) and not path.name.startswith("."))
+    
+    def list_backup_metadata(self):
+        """Metadata of every backup stored in the container, newest first"""
+        backups = []
+        for name in self.list_container("backup_"):
+            if name.endswith(".zip.meta") and self.blob_exists(name[:-len(".meta")]):
+                backups.append(json.loads(self.download_blob(name)))
+        return sorted(backups, key=backup_order, reverse=True)
+    
     def list_blobs(self):
         """List all blobs in cloud storage"""
         return self.metadata.get("blobs", [])
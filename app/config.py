@@ -20,6 +20,85 @@ BACKUP_CONFIG = {
     "retention_days": 30,
     "compression": "zip",
     "include_db": False,
+    "incremental": False,
+    "full_backup_every": 7,
+    "resume_interrupted": True,
+    "checkpoint_interval_files": 500,
+    "checkpoint_interval_mb": 256,
+}
+
+# Database sources, snapshotted into every backup when BACKUP_CONFIG["include_db"] is set
+DB_CONFIG = {
+    "databases": [
+        # {"name": "app", "engine": "sqlite", "path": str(BASE_DIR / "data" / "app.db")},
+        # {"name": "orders", "engine": "postgres", "dsn": "postgresql://backup@localhost/orders"},
+        # {"name": "legacy", "engine": "command", "command": ["mysqldump", "legacy"], "suffix": ".sql"},
+    ],
+    "sqlite": {
+        "pages_per_step": 256,     # pages copied per step; writers can get in between steps
+        "step_pause_ms": 5,        # pause after every step
+        "busy_sleep_s": 0.25,      # back-off when a step finds the database locked
+        "max_restarts": 3,         # stepped copies restarted by writes before copying in one step
+        "format": "auto",          # "sqlite" image (Python 3.11+), "sql" dump, or "auto"
+        "memory_limit_mb": 64,     # larger databases are copied into a spool file instead of memory
+        "spool_dir": None,         # directory for spool files (None: the system temp directory)
+    },
+    "dump_timeout_s": 3600,
+}
+
+# Restore configuration
+RESTORE_CONFIG = {
+    "workers": min(8, (os.cpu_count() or 4) * 2),
+    "verify_checksums": False,
+    # restore_location given to POST /jobs/restore must lie below one of these
+    "api_restore_roots": [str(BASE_DIR / "restores")],
+}
+
+# Encryption configuration
+ENCRYPTION_CONFIG = {
+    "enabled": False,
+    "algorithm": "AES-256-GCM",
+    "key_env_var": "BACKUP_MASTER_KEY",
+    "key_file": str(BASE_DIR / "keys" / "master.key"),
+    "chunk_size_kb": 1024,
+    "compression_level": 6,
+    "workers": os.cpu_count() or 4,
+}
+
+# Profiling configuration
+PROFILING_CONFIG = {
+    "write_trace": True,
+    "large_file_mb": 64,
+    "cprofile": False,
+    "tracemalloc": False,
+    "top_n": 15,
+}
+
+# Background job configuration (web server job API)
+JOBS_CONFIG = {
+    "workers": 2,
+    "max_queued": 16,
+    "history": 100,
+    "stream_interval_s": 0.5,
+}
+
+# Host metrics sampler (GUI monitor, /metrics and the backup throttle)
+METRICS_CONFIG = {
+    "interval_s": 1.0,
+    "history_s": 3600,             # ring buffer length
+    "summary_window_s": 300,       # window of the percentiles reported by /metrics
+    "percentiles": [50, 95, 99],
+    "throttle": {
+        "enabled": False,
+        "cpu_percent": 90,         # median CPU over window_s above which a backup pauses
+        # same for source/backup disk busy time, less the share of the volume's throughput
+        # this backup causes itself (its reads on the source, its writes on the backup disk)
+        "io_busy_percent": 80,
+        "window_s": 5,
+        "check_every_s": 1.0,
+        "pause_s": 0.5,
+        "max_pause_s": 30,         # longest pause per file, so a backup always progresses
+    },
 }
 
 # Cloud simulation configuration
@@ -29,6 +108,31 @@ CLOUD_CONFIG = {
     "storage_account": "backupstorage123",
     "simulate_locally": True,
     "local_storage_path": str(BACKUP_DIR),
+    # Uploaded blobs live outside backups/ so they survive losing the local copies
+    "blob_storage_path": str(BASE_DIR / "cloud_storage"),
+    "upload_mode": "hardlink",  # "hardlink" (archives are never rewritten in place) or "copy"
+    "download_latency_ms": 40,
+    "download_bandwidth_mb_s": 100,
+    "download_workers": 8,
+    "download_block_kb": 1024,
+    "download_request_mb": 8,
+    "prefetch_mb": 256,
+    "block_cache_path": str(BASE_DIR / "cache" / "blocks"),
+    "block_cache_mb": 2048,
+}
+
+# Disaster drills (scripted damage + timed recovery of a copy of the sources)
+DRILL_CONFIG = {
+    "workspace": str(BASE_DIR / "drills"),
+    "results_file": str(LOG_DIR / "drill_results.jsonl"),
+    "damage_fraction": 0.2,        # share of files damaged by a drill
+    "post_backup_writes": 5,       # files changed after the backup, lost by design (the RPO window)
+    "disaster_after_s": 300,       # disaster this long after the backup (scheduler interval: worst case)
+    "load_workers": 0,             # background I/O + CPU load threads during recovery
+    "rto_target_s": 30,
+    "rpo_target_s": 300,           # auto-backup interval
+    "trend_runs": 10,              # earlier runs of a scenario a new result is compared with
+    "keep_workspace": False,
 }
 
 # Logging configuration
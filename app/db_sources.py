@@ -0,0 +1,280 @@
+"""Database Sources - Consistent online snapshots of live databases
+
+Copying a live database file gives a torn snapshot, so databases listed in
+DB_CONFIG are archived through a source plugin instead. A source produces a
+consistent snapshot as a binary stream that the backup writes straight into
+the archive as ``_databases/<name><suffix>``.
+
+* SQLiteSource uses SQLite's online backup API, copying a configurable
+  number of pages per step and pausing in between so writers are not
+  blocked for the length of the backup. A write from another connection
+  restarts a stepped copy, so after max_restarts the copy is finished in a
+  single step instead. The copy needs somewhere to live: databases up to
+  memory_limit_mb are copied into memory, larger ones into a temporary
+  spool file, so memory use stays bounded whatever the database size.
+* CommandDumpSource streams the stdout of a dump tool, with no copy at all,
+  and kills the tool once dump_timeout_s has passed; PostgresDumpSource
+  builds the pg_dump command line for it.
+
+New engines subclass DatabaseSource and register in SOURCE_TYPES.
+"""
+import io
+import os
+import time
+import signal
+import sqlite3
+import subprocess
+import tempfile
+import threading
+from contextlib import contextmanager
+from pathlib import Path
+from config import DB_CONFIG
+from profiler import NULL_TRACER
+from progress import NULL_PROGRESS
+
+DB_ARCHIVE_DIR = "_databases"
+
+
+class DatabaseSourceError(Exception):
+    """Raised when a database snapshot cannot be taken"""
+
+
+class DatabaseSource:
+    """A database archived as a single snapshot member"""
+
+    engine = None
+    suffix = ".dump"
+
+    def __init__(self, name, options, config=None):
+        self.name = name
+        self.options = options
+        self.config = config or DB_CONFIG
+
+    @property
+    def arcname(self):
+        return f"{DB_ARCHIVE_DIR}/{self.name}{self.suffix}"
+
+    def size_hint(self):
+        """Expected snapshot size in bytes, or None if unknown"""
+        return None
+
+    @contextmanager
+    def snapshot(self, tracer=NULL_TRACER, progress=NULL_PROGRESS):
+        """Yield a readable binary stream of a consistent snapshot"""
+        raise NotImplementedError
+
+
+class _CopyRestarted(Exception):
+    """Internal: abandon a stepped SQLite copy that keeps restarting"""
+
+
+class _LineStream(io.RawIOBase):
+    """Binary stream over an iterator of text lines (e.g. Connection.iterdump())"""
+
+    def __init__(self, lines):
+        self._lines = lines
+        self._pending = b""
+
+    def readable(self):
+        return True
+
+    def readinto(self, buffer):
+        while not self._pending:
+            line = next(self._lines, None)
+            if line is None:
+                return 0
+            self._pending = (line + "\n").encode()
+        n = min(len(buffer), len(self._pending))
+        buffer[:n] = self._pending[:n]
+        self._pending = self._pending[n:]
+        return n
+
+
+class SQLiteSource(DatabaseSource):
+    """SQLite database copied page by page through the online backup API"""
+
+    engine = "sqlite"
+
+    def __init__(self, name, options, config=None):
+        super().__init__(name, options, config)
+        self.path = Path(options["path"])
+        self.settings = dict(self.config["sqlite"], **options.get("sqlite", {}))
+        output = self.settings["format"]
+        if output == "auto":
+            # Connection.serialize() only exists on Python 3.11+
+            output = "sqlite" if hasattr(sqlite3.Connection, "serialize") else "sql"
+        if output not in ("sqlite", "sql"):
+            raise DatabaseSourceError(f"Unknown SQLite snapshot format: {output}")
+        self.format = output
+        self.suffix = ".sqlite" if output == "sqlite" else ".sql"
+
+    def size_hint(self):
+        try:
+            size = self.path.stat().st_size
+        except OSError:
+            return None
+        wal = self.path.with_name(self.path.name + "-wal")
+        if wal.exists():
+            size += wal.stat().st_size
+        return size
+
+    @contextmanager
+    def snapshot(self, tracer=NULL_TRACER, progress=NULL_PROGRESS):
+        """Copy the database in steps into memory or a spool file, then stream the copy"""
+        if not self.path.is_file():
+            raise DatabaseSourceError(f"SQLite database not found: {self.path}")
+        if (self.size_hint() or 0) <= self.settings["memory_limit_mb"] * 1024 * 1024:
+            with self._copy(sqlite3.connect(":memory:"), tracer, progress) as snapshot:
+                if self.format == "sqlite":
+                    yield io.BytesIO(snapshot.serialize())
+                else:
+                    yield io.BufferedReader(_LineStream(snapshot.iterdump()))
+            return
+        with tempfile.TemporaryDirectory(prefix="db-snapshot-", dir=self.settings["spool_dir"]) as spool:
+            spool_path = Path(spool) / f"{self.name}.sqlite"
+            destination = sqlite3.connect(spool_path)
+            # A throwaway copy: no journal or fsyncs needed while it is written
+            destination.execute("PRAGMA journal_mode=OFF")
+            destination.execute("PRAGMA synchronous=OFF")
+            with self._copy(destination, tracer, progress, spooled=True) as snapshot:
+                if self.format == "sql":
+                    yield io.BufferedReader(_LineStream(snapshot.iterdump()))
+                    return
+            with open(spool_path, 'rb') as image:
+                yield image
+
+    @contextmanager
+    def _copy(self, snapshot, tracer, progress, spooled=False):
+        """Back the database up into the snapshot connection, yield it, and close it"""
+        pause = self.settings["step_pause_ms"] / 1000.0
+        state = {"remaining": None, "restarts": 0}
+
+        def between_steps(status, remaining, total):
+            progress.check_cancelled()
+            if state["remaining"] is not None and remaining > state["remaining"]:
+                state["restarts"] += 1
+                if state["restarts"] > self.settings["max_restarts"]:
+                    raise _CopyRestarted()
+            state["remaining"] = remaining
+            if pause and remaining:
+                time.sleep(pause)
+
+        try:
+            source = sqlite3.connect(f"{self.path.resolve().as_uri()}?mode=ro", uri=True)
+            try:
+                with tracer.span("db_snapshot", db=self.name, spooled=spooled) as args:
+                    try:
+                        source.backup(snapshot, pages=self.settings["pages_per_step"], progress=between_steps,
+                                      sleep=self.settings["busy_sleep_s"])
+                    except _CopyRestarted:
+                        args["single_step"] = True
+                        source.backup(snapshot, pages=-1, sleep=self.settings["busy_sleep_s"])
+                    args["restarts"] = state["restarts"]
+            except sqlite3.Error as e:
+                raise DatabaseSourceError(f"SQLite backup of {self.name} failed: {e}")
+            finally:
+                source.close()
+            yield snapshot
+        finally:
+            snapshot.close()
+
+
+class CommandDumpSource(DatabaseSource):
+    """Database dumped by an external tool whose stdout is archived as it is produced"""
+
+    engine = "command"
+
+    def __init__(self, name, options, config=None):
+        super().__init__(name, options, config)
+        self.suffix = options.get("suffix", self.suffix)
+
+    def command(self):
+        return list(self.options["command"])
+
+    def environment(self):
+        return None
+
+    @contextmanager
+    def snapshot(self, tracer=NULL_TRACER, progress=NULL_PROGRESS):
+        command = self.command()
+        timeout = self.config["dump_timeout_s"]
+        with tempfile.TemporaryFile() as stderr:
+            try:
+                # Own process group: wrappers (sh -c, scripts) pass stdout on to their children
+                proc = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=stderr, env=self.environment(),
+                                        start_new_session=True)
+            except OSError as e:
+                raise DatabaseSourceError(f"Cannot run {command[0]} for {self.name}: {e}")
+            # The archiver blocks in read() while the tool is silent, so the deadline is
+            # enforced by killing the tool, which ends the stream
+            timed_out = threading.Event()
+
+            def expire():
+                timed_out.set()
+                _kill_tree(proc)
+
+            watchdog = threading.Timer(timeout, expire)
+            watchdog.daemon = True
+            watchdog.start()
+            try:
+                yield proc.stdout
+                proc.stdout.close()
+                returncode = proc.wait()
+            except BaseException:
+                _kill_tree(proc)
+                proc.wait()
+                raise
+            finally:
+                watchdog.cancel()
+            if timed_out.is_set():
+                raise DatabaseSourceError(f"{command[0]} for {self.name} timed out after {timeout}s")
+            if returncode != 0:
+                stderr.seek(0)
+                detail = stderr.read()[-2000:].decode(errors="replace").strip()
+                raise DatabaseSourceError(f"{command[0]} exited with {returncode} for {self.name}: {detail}")
+
+
+def _kill_tree(proc):
+    """Kill a dump tool started in its own session together with everything it spawned"""
+    if hasattr(os, "killpg"):
+        try:
+            os.killpg(proc.pid, signal.SIGKILL)
+            return
+        except (ProcessLookupError, PermissionError):
+            pass
+    proc.kill()
+
+
+class PostgresDumpSource(CommandDumpSource):
+    """PostgreSQL database dumped with pg_dump in its custom format (restore with pg_restore)"""
+
+    engine = "postgres"
+    suffix = ".pgdump"
+
+    def command(self):
+        return ([self.options.get("pg_dump", "pg_dump"), "--format=custom", "--no-password",
+                 f"--dbname={self.options['dsn']}"] + list(self.options.get("args", [])))
+
+
+SOURCE_TYPES = {
+    "sqlite": SQLiteSource,
+    "command": CommandDumpSource,
+    "postgres": PostgresDumpSource,
+}
+
+
+def configured_sources(config=None):
+    """Source objects for every database in DB_CONFIG"""
+    config = config or DB_CONFIG
+    sources = []
+    names = set()
+    for options in config["databases"]:
+        engine = options.get("engine")
+        if engine not in SOURCE_TYPES:
+            raise DatabaseSourceError(f"Unknown database engine {engine!r} for {options.get('name')}")
+        name = options["name"]
+        if name in names or "/" in name or name in ("", ".", ".."):
+            raise DatabaseSourceError(f"Invalid or duplicate database name: {name!r}")
+        names.add(name)
+        sources.append(SOURCE_TYPES[engine](name, options, config))
+    return sources
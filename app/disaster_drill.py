@@ -0,0 +1,442 @@
+"""Disaster Drills - Measured recovery of a damaged copy of the sources
+
+A drill copies the configured source directories into a workspace, backs the
+copy up into its own backup directory and cloud container, changes a few
+files after the backup (the writes a real disaster loses) and then damages
+the copy: files are deleted, silently corrupted (same size and mtime) or
+truncated, or for a total loss the sources and the local backups are
+removed altogether. Recovery runs end to end through RestoreSystem, in place
+and with checksums, and the tree is verified against the hashes taken at
+backup time.
+
+The disaster is placed DRILL_CONFIG["disaster_after_s"] after the backup on
+the drill's timeline (by default one scheduler interval: the worst case,
+just before the next backup), with the post-backup writes spread over that
+interval. RPO is the time from the newest write the recovery brought back -
+the backup itself, unless a later write survived - to the disaster.
+
+Each result - achieved RTO, RPO, lost and unrecovered files, host load - is
+appended to DRILL_CONFIG["results_file"] and compared
+with earlier runs of the same scenario. Run headless with:
+
+    python app/disaster_drill.py --scenario mixed --load-workers 2
+    python app/disaster_drill.py --history
+"""
+import argparse
+import datetime
+import hashlib
+import json
+import os
+import random
+import shutil
+import statistics
+import sys
+import threading
+import time
+from pathlib import Path
+from config import BACKUP_CONFIG, CLOUD_CONFIG, DRILL_CONFIG, LOG_CONFIG
+from backup import BackupSystem
+from restore import RestoreSystem
+from progress import NULL_PROGRESS, JobCancelled
+import archive
+import metrics_sampler
+import restore_planner
+import logging
+
+logging.basicConfig(
+    filename=LOG_CONFIG["log_file"],
+    level=LOG_CONFIG["log_level"],
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+# Damage applied by each scenario; total_loss removes the sources and local backups instead
+SCENARIOS = {
+    "delete": ("delete",),
+    "corrupt": ("corrupt",),
+    "truncate": ("truncate",),
+    "mixed": ("delete", "corrupt", "truncate"),
+    "total_loss": (),
+}
+
+# Scenario drilled for each disaster button of the dashboard
+DISASTER_SCENARIOS = {
+    "Server Crash": "truncate",
+    "Server Overload": "mixed",
+    "Total Loss": "total_loss",
+    "Data Corruption": "corrupt",
+}
+
+_PAST_TENSE = {"delete": "deleted", "corrupt": "corrupted", "truncate": "truncated"}
+
+
+def _hash_tree(sources):
+    """{arcname: (sha256, size)} for every file below the source directories"""
+    hashes = {}
+    for source in sources:
+        for path in sorted(source.rglob("*")):
+            if path.is_file():
+                arcname = path.relative_to(source.parent).as_posix()
+                hashes[arcname] = (archive.hash_file(path), path.stat().st_size)
+    return hashes
+
+
+class _BackgroundLoad:
+    """Threads that keep the disk and a CPU busy while the recovery runs"""
+
+    def __init__(self, path, workers, chunk_mb=8):
+        self.path = Path(path)
+        self.workers = workers
+        self.chunk_mb = chunk_mb
+        self._stop = threading.Event()
+        self._threads = []
+
+    def __enter__(self):
+        if self.workers:
+            self.path.mkdir(parents=True, exist_ok=True)
+        for index in range(self.workers):
+            thread = threading.Thread(target=self._work, args=(index,), name=f"drill-load-{index}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        for thread in self._threads:
+            thread.join()
+        shutil.rmtree(self.path, ignore_errors=True)
+
+    def _work(self, index):
+        block = os.urandom(1024 * 1024)
+        target = self.path / f"load_{index}.bin"
+        while not self._stop.is_set():
+            with open(target, 'wb') as f:
+                for _ in range(self.chunk_mb):
+                    f.write(block)
+                f.flush()
+                os.fsync(f.fileno())
+            with open(target, 'rb') as f:
+                hashlib.sha256(f.read()).hexdigest()
+
+
+class DisasterDrill:
+    """One scripted disaster and timed recovery on a copy of the sources"""
+
+    def __init__(self, scenario="mixed", config=None, load_workers=None, damage_fraction=None, seed=None):
+        if scenario not in SCENARIOS:
+            raise ValueError(f"Unknown drill scenario: {scenario}")
+        self.scenario = scenario
+        self.config = config or DRILL_CONFIG
+        self.load_workers = self.config["load_workers"] if load_workers is None else load_workers
+        self.damage_fraction = self.config["damage_fraction"] if damage_fraction is None else damage_fraction
+        self.random = random.Random(seed)
+        self.last_result = None
+
+    def run(self, progress=None):
+        """Run the drill; returns (passed, result), or (False, None) if the drill itself failed"""
+        progress = progress or NULL_PROGRESS
+        started = datetime.datetime.now()
+        drill_id = f"{started.strftime('%Y-%m-%d_%H-%M-%S')}_{self.scenario}"
+        workspace = Path(self.config["workspace"]) / drill_id
+        try:
+            progress.start("preparing")
+            sampler = metrics_sampler.shared_sampler()
+            logging.info(f"Starting disaster drill: {drill_id}")
+            print(f"🧪 Disaster drill: {self.scenario} ({drill_id})")
+            sources = self._copy_sources(workspace / "sources")
+            backup_config = dict(BACKUP_CONFIG, source_dirs=[str(s) for s in sources],
+                                 backup_location=str(workspace / "backups"),
+                                 include_db=False, incremental=False, resume_interrupted=False)
+            cloud_config = dict(CLOUD_CONFIG, local_storage_path=backup_config["backup_location"],
+                                blob_storage_path=str(workspace / "cloud"),
+                                block_cache_path=str(workspace / "cache"))
+            expected = _hash_tree(sources)
+
+            progress.set_phase("backing up")
+            backup_started_at = time.time()
+            clock = time.monotonic()
+            ok, backup_name, _ = BackupSystem(backup_config, cloud_config).create_backup(progress=progress)
+            progress.check_cancelled()
+            if not ok:
+                raise RuntimeError("Drill backup failed")
+            backup_s = time.monotonic() - clock
+
+            progress.set_phase("writing after backup")
+            writes = self._write_after_backup(sources, expected, backup_started_at)
+            before_disaster = dict(expected, **_hash_tree(sources))
+
+            progress.set_phase("damaging")
+            disaster_at = backup_started_at + self.config["disaster_after_s"]
+            damage = self._damage(sources, expected, Path(backup_config["backup_location"]))
+            print(f"   💥 Damage: {', '.join(f'{count} {kind}' for kind, count in damage.items())}")
+
+            progress.set_phase("recovering")
+            restore_system = RestoreSystem(backup_config, cloud_config)
+            if self.scenario == "total_loss":
+                restore = restore_system.restore_from_cloud
+            else:
+                restore = restore_system.restore_backup
+            with _BackgroundLoad(workspace / "load", self.load_workers):
+                # Bracket the recovery with samples so even a short one has host metrics
+                recovery_started_at = time.time()
+                sampler.sample()
+                clock = time.monotonic()
+                restored = restore(backup_name, in_place=True, checksum=True, progress=progress)
+                progress.check_cancelled()
+                restore_s = time.monotonic() - clock
+                progress.set_phase("verifying")
+                actual = _hash_tree(sources)
+                rto_s = time.monotonic() - clock
+                sampler.sample()
+            verify_s = rto_s - restore_s
+
+            failed = sorted(arcname for arcname, digest in expected.items() if actual.get(arcname) != digest)
+            lost = [arcname for arcname in writes if actual.get(arcname) != before_disaster[arcname]]
+            recovered_point = max([backup_started_at] + [write["at"] for arcname, write in writes.items()
+                                                         if arcname not in lost])
+            rpo_s = disaster_at - recovered_point
+            live_rpo_s = self._live_rpo()
+            result = {
+                "drill_id": drill_id,
+                "scenario": self.scenario,
+                "started_at": started.isoformat(),
+                "files": len(expected),
+                "bytes": sum(size for _, size in expected.values()),
+                "backup_s": round(backup_s, 3),
+                "damage": damage,
+                "load_workers": self.load_workers,
+                "restored": restored,
+                "restore_s": round(restore_s, 3),
+                "verify_s": round(verify_s, 3),
+                "rto_s": round(rto_s, 3),
+                "rto_target_s": self.config["rto_target_s"],
+                "met_rto": rto_s <= self.config["rto_target_s"],
+                "disaster_after_s": self.config["disaster_after_s"],
+                "rpo_s": round(rpo_s, 3),
+                "live_rpo_s": round(live_rpo_s, 1) if live_rpo_s is not None else None,
+                "rpo_target_s": self.config["rpo_target_s"],
+                "met_rpo": max(rpo_s, live_rpo_s or 0.0) <= self.config["rpo_target_s"],
+                "lost_files": len(lost),
+                "lost_bytes": sum(writes[arcname]["bytes"] for arcname in lost),
+                "verified_files": len(expected) - len(failed),
+                "failed_files": len(failed),
+                "failed_sample": failed[:20],
+                "host": self._host_load(sampler, recovery_started_at),
+                "restore_profile": {key: value for key, value in (restore_system.last_profile or {}).items()
+                                    if key not in ("cprofile_top", "tracemalloc_top")},
+            }
+            result["passed"] = restored and not failed and result["met_rto"] and result["met_rpo"]
+            result["trend"] = trend(result, load_results(self.scenario, self.config["trend_runs"], self.config))
+            self._store(result)
+            self.last_result = result
+            self._report(result)
+            logging.info(f"Disaster drill {drill_id}: RTO {result['rto_s']}s, {len(failed)} files not recovered, "
+                         f"{'passed' if result['passed'] else 'FAILED'}")
+            return result["passed"], result
+
+        except JobCancelled:
+            logging.warning(f"Disaster drill cancelled: {drill_id}")
+            print("🛑 Drill cancelled")
+            return False, None
+        except Exception as e:
+            logging.error(f"Disaster drill failed: {str(e)}")
+            print(f"❌ Drill failed: {str(e)}")
+            return False, None
+        finally:
+            if not self.config["keep_workspace"]:
+                shutil.rmtree(workspace, ignore_errors=True)
+
+    def _copy_sources(self, root):
+        """Copy every configured source directory below root, keeping their names"""
+        sources = []
+        for source_dir in BACKUP_CONFIG["source_dirs"]:
+            source = Path(source_dir)
+            if not source.exists():
+                continue
+            target = root / source.name
+            shutil.copytree(source, target)
+            sources.append(target)
+        if not sources:
+            raise RuntimeError("No source directories to drill")
+        return sources
+
+    def _write_after_backup(self, sources, expected, backup_at):
+        """Append to a few files after the backup: {arcname: {"bytes", "at"}}.
+
+        "at" places each write evenly between the backup and the disaster on
+        the drill's timeline.
+        """
+        count = min(self.config["post_backup_writes"], len(expected))
+        written = {}
+        for position, arcname in enumerate(self.random.sample(sorted(expected), count)):
+            data = f"drill write {time.time_ns()}\n".encode()
+            with open(self._path(sources, arcname), 'ab') as f:
+                f.write(data)
+            at = backup_at + self.config["disaster_after_s"] * (position + 1) / (count + 1)
+            written[arcname] = {"bytes": len(data), "at": at}
+        return written
+
+    def _damage(self, sources, expected, backup_dir):
+        """Apply the scenario's damage; returns {what: file count}"""
+        if self.scenario == "total_loss":
+            for source in sources:
+                shutil.rmtree(source)
+            shutil.rmtree(backup_dir)
+            return {"destroyed": len(expected), "local backups destroyed": 1}
+        kinds = SCENARIOS[self.scenario]
+        candidates = sorted(arcname for arcname, (_, size) in expected.items() if size > 0)
+        count = min(len(candidates), max(len(kinds), round(self.damage_fraction * len(expected))))
+        damage = {_PAST_TENSE[kind]: 0 for kind in kinds}
+        for position, arcname in enumerate(self.random.sample(candidates, count)):
+            kind = kinds[position % len(kinds)]
+            path = self._path(sources, arcname)
+            if kind == "delete":
+                path.unlink()
+            elif kind == "truncate":
+                os.truncate(path, path.stat().st_size // 2)
+            else:
+                # Silent corruption: a few flipped bytes, size and mtime unchanged
+                stat = path.stat()
+                with open(path, 'r+b') as f:
+                    for offset in self.random.sample(range(stat.st_size), min(16, stat.st_size)):
+                        f.seek(offset)
+                        byte = f.read(1)[0]
+                        f.seek(offset)
+                        f.write(bytes([byte ^ 0xFF]))
+                os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns))
+            damage[_PAST_TENSE[kind]] += 1
+        return damage
+
+    @staticmethod
+    def _host_load(sampler, since):
+        """95th percentiles of the host metrics sampled since the recovery started"""
+        fields = ("cpu_percent", "memory_percent", "backup_busy_percent")
+        times, *columns = sampler.buffer.columns(("time",) + fields, since)
+        load = {"samples": len(times)}
+        for field, values in zip(fields, columns):
+            value = metrics_sampler.percentile(values, 95)
+            load[f"{field}_p95"] = round(value, 1) if value is not None else None
+        return load
+
+    @staticmethod
+    def _path(sources, arcname):
+        return sources[0].parent / arcname
+
+    @staticmethod
+    def _live_rpo():
+        """Age of the newest real backup: what a disaster right now would lose"""
+        # Read-only: only the committed .meta files are looked at, nothing is recovered or created
+        catalog = restore_planner.BackupCatalog(Path(BACKUP_CONFIG["backup_location"]))
+        stamps = [catalog.load_meta(meta.name[:-len(".meta")]).get("timestamp", "")
+                  for meta in catalog.backup_dir.glob("backup_*.zip.meta")]
+        if not stamps:
+            return None
+        try:
+            newest = datetime.datetime.strptime(max(stamps)[:19], "%Y-%m-%d_%H-%M-%S")
+        except ValueError:
+            return None
+        return (datetime.datetime.now() - newest).total_seconds()
+
+    def _store(self, result):
+        results_file = Path(self.config["results_file"])
+        results_file.parent.mkdir(parents=True, exist_ok=True)
+        with open(results_file, 'a') as f:
+            f.write(json.dumps(result) + "\n")
+
+    @staticmethod
+    def _report(result):
+        print("=" * 50)
+        print(f"{'✅' if result['passed'] else '❌'} Drill {result['scenario']}: "
+              f"{'PASSED' if result['passed'] else 'FAILED'}")
+        print(f"   Files: {result['files']} ({result['bytes'] / (1024 * 1024):.1f} MB), "
+              f"damage: {result['damage']}")
+        print(f"   RTO: {result['rto_s']:.2f}s (restore {result['restore_s']:.2f}s + verify "
+              f"{result['verify_s']:.2f}s), target {result['rto_target_s']}s")
+        live = f", newest real backup {result['live_rpo_s']:.0f}s old" if result["live_rpo_s"] is not None else ""
+        print(f"   RPO: {result['rpo_s']:.0f}s with the disaster {result['disaster_after_s']}s after the backup{live}, "
+              f"target {result['rpo_target_s']}s; lost {result['lost_files']} files ({result['lost_bytes']} bytes) "
+              f"written after the backup")
+        print(f"   Verified: {result['verified_files']}/{result['files']} files match the backup")
+        host = result["host"]
+        cpu = f"{host['cpu_percent_p95']:.0f}%" if host["cpu_percent_p95"] is not None else "n/a"
+        print(f"   Host during recovery: CPU p95 {cpu} over {host['samples']} samples")
+        trend_info = result["trend"]
+        if trend_info["runs"]:
+            print(f"   Trend: median RTO of the last {trend_info['runs']} runs {trend_info['median_rto_s']:.2f}s "
+                  f"({trend_info['rto_change_pct']:+.1f}%)")
+
+
+def load_results(scenario=None, limit=None, config=None):
+    """Stored drill results, oldest first, optionally only one scenario's last `limit` runs"""
+    config = config or DRILL_CONFIG
+    results_file = Path(config["results_file"])
+    if not results_file.exists():
+        return []
+    results = []
+    with open(results_file, 'r') as f:
+        for line in f:
+            try:
+                result = json.loads(line)
+            except ValueError:
+                continue  # a line torn by a crash mid-append
+            if scenario is None or result.get("scenario") == scenario:
+                results.append(result)
+    return results[-limit:] if limit else results
+
+
+def trend(result, history):
+    """Compare a result's RTO with earlier runs"""
+    rtos = [previous["rto_s"] for previous in history]
+    if not rtos:
+        return {"runs": 0}
+    median = statistics.median(rtos)
+    return {
+        "runs": len(rtos),
+        "median_rto_s": round(median, 3),
+        "best_rto_s": min(rtos),
+        "worst_rto_s": max(rtos),
+        "rto_change_pct": round(100.0 * (result["rto_s"] - median) / median, 1) if median else 0.0,
+        "pass_rate": round(sum(1 for previous in history if previous.get("passed")) / len(history), 2),
+    }
+
+
+def print_history(limit):
+    results = load_results(limit=limit)
+    if not results:
+        print("No drill results yet")
+        return
+    print(f"{'drill':<36} {'RTO s':>8} {'RPO s':>8} {'lost':>5} {'failed':>6}  result")
+    for result in results:
+        print(f"{result['drill_id']:<36} {result['rto_s']:>8.2f} {result['rpo_s']:>8.2f} "
+              f"{result['lost_files']:>5} {result['failed_files']:>6}  {'pass' if result['passed'] else 'FAIL'}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--scenario", choices=sorted(SCENARIOS), default="mixed")
+    parser.add_argument("--fraction", type=float, default=None, help="share of files to damage")
+    parser.add_argument("--load-workers", type=int, default=None, help="background load threads during recovery")
+    parser.add_argument("--disaster-after", type=float, default=None,
+                        help="seconds between the backup and the disaster on the drill timeline")
+    parser.add_argument("--seed", type=int, default=None)
+    parser.add_argument("--keep", action="store_true", help="keep the drill workspace for inspection")
+    parser.add_argument("--json", action="store_true", help="print the result as JSON")
+    parser.add_argument("--history", type=int, nargs="?", const=20, default=None,
+                        help="show the last N stored results instead of running a drill")
+    args = parser.parse_args()
+
+    if args.history is not None:
+        print_history(args.history)
+        return 0
+    config = dict(DRILL_CONFIG, keep_workspace=args.keep or DRILL_CONFIG["keep_workspace"])
+    if args.disaster_after is not None:
+        config["disaster_after_s"] = args.disaster_after
+    drill = DisasterDrill(args.scenario, config, load_workers=args.load_workers,
+                          damage_fraction=args.fraction, seed=args.seed)
+    passed, result = drill.run()
+    if args.json and result is not None:
+        print(json.dumps(result, indent=2))
+    return 0 if passed else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,126 @@
+"""Backup Encryption - Per-backup data keys and chunked AEAD sealing"""
+import os
+import base64
+import hashlib
+import struct
+from pathlib import Path
+from config import ENCRYPTION_CONFIG
+
+try:
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+except ImportError:  # optional dependency, only needed when encryption is enabled
+    AESGCM = None
+
+NONCE_PREFIX_SIZE = 8
+KEY_SIZE = 32
+
+
+class EncryptionError(Exception):
+    """Raised when a backup cannot be encrypted or decrypted"""
+
+
+def _require_backend():
+    if AESGCM is None:
+        raise EncryptionError("Encryption requires the 'cryptography' package (pip install cryptography)")
+
+
+def load_master_key(create=True):
+    """Load the key-encryption key from the environment or the key file"""
+    config = ENCRYPTION_CONFIG
+    encoded = os.environ.get(config["key_env_var"])
+    if encoded:
+        key = base64.b64decode(encoded)
+    else:
+        key_file = Path(config["key_file"])
+        if key_file.exists():
+            key = base64.b64decode(key_file.read_bytes().strip())
+        elif create:
+            key = os.urandom(KEY_SIZE)
+            key_file.parent.mkdir(parents=True, exist_ok=True)
+            fd = os.open(key_file, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+            with os.fdopen(fd, 'wb') as f:
+                f.write(base64.b64encode(key) + b"\n")
+        else:
+            raise EncryptionError(f"Master key not found: {key_file}")
+    if len(key) != KEY_SIZE:
+        raise EncryptionError(f"Master key must be {KEY_SIZE} bytes, got {len(key)}")
+    return key
+
+
+def key_id(key):
+    """Short, non-secret fingerprint used to identify a key in metadata"""
+    return hashlib.sha256(b"backup-key-id:" + key).hexdigest()[:16]
+
+
+class BackupCipher:
+    """Seals compressed chunks with a per-backup data key.
+
+    Every chunk gets its own AEAD frame so chunks can be sealed and opened
+    independently (and therefore in parallel). The nonce is the member's
+    random prefix followed by the chunk index, and the associated data binds
+    each frame to its archive member, position and "final chunk" flag so
+    frames cannot be reordered, swapped between files or truncated.
+    """
+
+    def __init__(self, data_key, master_key):
+        _require_backend()
+        self.data_key = data_key
+        self.master_key = master_key
+        self.key_id = key_id(data_key)
+        self.kek_id = key_id(master_key)
+        self._aead = AESGCM(data_key)
+
+    @classmethod
+    def generate(cls, master_key=None):
+        """Create a cipher with a fresh random data key"""
+        _require_backend()
+        return cls(AESGCM.generate_key(bit_length=KEY_SIZE * 8), master_key or load_master_key())
+
+    @classmethod
+    def from_metadata(cls, encryption_meta, data_key_id=None, master_key=None):
+        """Unwrap a data key recorded in a backup's .meta"""
+        _require_backend()
+        master_key = master_key or load_master_key(create=False)
+        if encryption_meta.get("kek_id") != key_id(master_key):
+            raise EncryptionError(f"Backup was encrypted with master key {encryption_meta.get('kek_id')}, "
+                                  f"but the loaded master key is {key_id(master_key)}")
+        data_key_id = data_key_id or encryption_meta["data_key_id"]
+        wrapped = base64.b64decode(encryption_meta["wrapped_keys"][data_key_id])
+        nonce, sealed = wrapped[:12], wrapped[12:]
+        try:
+            data_key = AESGCM(master_key).decrypt(nonce, sealed, data_key_id.encode())
+        except Exception:
+            raise EncryptionError(f"Unable to unwrap data key {data_key_id}")
+        return cls(data_key, master_key)
+
+    def wrapped_key(self):
+        """Data key sealed under the master key, base64 encoded"""
+        nonce = os.urandom(12)
+        sealed = AESGCM(self.master_key).encrypt(nonce, self.data_key, self.key_id.encode())
+        return base64.b64encode(nonce + sealed).decode()
+
+    def metadata(self):
+        """Key information stored in the backup's .meta"""
+        return {
+            "algorithm": ENCRYPTION_CONFIG["algorithm"],
+            "kek_id": self.kek_id,
+            "data_key_id": self.key_id,
+            "wrapped_keys": {self.key_id: self.wrapped_key()},
+        }
+
+    @staticmethod
+    def _nonce(prefix, index):
+        return prefix + struct.pack(">I", index)
+
+    @staticmethod
+    def _aad(arcname, index, final):
+        return arcname.encode() + struct.pack(">I?", index, final)
+
+    def seal(self, prefix, index, data, arcname, final):
+        return self._aead.encrypt(self._nonce(prefix, index), data, self._aad(arcname, index, final))
+
+    def open(self, prefix, index, data, arcname, final):
+        try:
+            return self._aead.decrypt(self._nonce(prefix, index), data, self._aad(arcname, index, final))
+        except Exception:
+            raise EncryptionError(f"Authentication failed for {arcname} chunk {index}")
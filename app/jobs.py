@@ -0,0 +1,142 @@
+"""Job Manager - Runs backups and restores in the background
+
+Jobs are queued onto a bounded worker pool and identified by an id the
+caller can poll, stream progress from, or cancel. A job function takes the
+job's Progress as its first argument and returns (success, result).
+"""
+import time
+import uuid
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from config import JOBS_CONFIG, LOG_CONFIG
+from progress import Progress, JobCancelled
+import logging
+
+logging.basicConfig(
+    filename=LOG_CONFIG["log_file"],
+    level=LOG_CONFIG["log_level"],
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+ACTIVE = ("queued", "running")
+
+
+class QueueFull(Exception):
+    """Raised when no more jobs can be queued"""
+
+
+class Job:
+    """One queued or running backup/restore"""
+
+    def __init__(self, kind, params):
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params
+        self.status = "queued"
+        self.result = None
+        self.error = None
+        self.created_at = time.time()
+        self.started_at = None
+        self.finished_at = None
+        self.cancel_event = threading.Event()
+        self.progress = Progress(self.cancel_event)
+        self.done = threading.Event()
+        self.future = None
+
+    @property
+    def finished(self):
+        return self.done.is_set()
+
+    def to_dict(self):
+        return {
+            "job_id": self.id,
+            "kind": self.kind,
+            "params": self.params,
+            "status": self.status,
+            "progress": self.progress.snapshot(),
+            "result": self.result,
+            "error": self.error,
+            "created_at": self.created_at,
+            "started_at": self.started_at,
+            "finished_at": self.finished_at,
+        }
+
+
+class JobManager:
+    """Bounded pool of background jobs, with a short history of finished ones"""
+
+    def __init__(self, config=None):
+        self.config = config or JOBS_CONFIG
+        self._executor = ThreadPoolExecutor(max_workers=self.config["workers"], thread_name_prefix="job")
+        self._jobs = OrderedDict()
+        self._lock = threading.Lock()
+
+    def submit(self, kind, fn, **params):
+        """Queue fn(progress, **params); raises QueueFull when the queue is at capacity"""
+        with self._lock:
+            active = sum(1 for job in self._jobs.values() if job.status in ACTIVE)
+            if active >= self.config["workers"] + self.config["max_queued"]:
+                raise QueueFull(f"{active} jobs already queued or running")
+            job = Job(kind, params)
+            self._jobs[job.id] = job
+            self._prune()
+        logging.info(f"Job queued: {job.id} ({kind})")
+        job.future = self._executor.submit(self._run, job, fn)
+        return job
+
+    def _run(self, job, fn):
+        if job.cancel_event.is_set():
+            self._finish(job, "cancelled")
+            return
+        job.status = "running"
+        job.started_at = time.time()
+        try:
+            success, job.result = fn(job.progress, **job.params)
+            if job.cancel_event.is_set() and not success:
+                self._finish(job, "cancelled")
+            else:
+                self._finish(job, "succeeded" if success else "failed",
+                             None if success else f"{job.kind} failed, see the log for details")
+        except JobCancelled:
+            self._finish(job, "cancelled")
+        except Exception as e:
+            logging.error(f"Job {job.id} crashed: {str(e)}")
+            self._finish(job, "failed", str(e))
+
+    def _finish(self, job, status, error=None):
+        job.status = status
+        job.error = error
+        job.finished_at = time.time()
+        job.done.set()
+        logging.info(f"Job {status}: {job.id} ({job.kind})")
+
+    def _prune(self):
+        """Forget the oldest finished jobs beyond the configured history"""
+        finished = [job_id for job_id, job in self._jobs.items() if job.finished]
+        for job_id in finished[:max(0, len(finished) - self.config["history"])]:
+            del self._jobs[job_id]
+
+    def get(self, job_id):
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def list(self):
+        with self._lock:
+            return list(self._jobs.values())
+
+    def cancel(self, job_id):
+        """Request cancellation; a running job stops at its next progress update"""
+        job = self.get(job_id)
+        if job is None or job.finished:
+            return job
+        job.cancel_event.set()
+        if job.future is not None and job.future.cancel():
+            self._finish(job, "cancelled")
+        return job
+
+    def shutdown(self, cancel=True):
+        if cancel:
+            for job in self.list():
+                job.cancel_event.set()
+        self._executor.shutdown(wait=True)
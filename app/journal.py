@@ -0,0 +1,356 @@
+"""Backup Journal - Atomic file commits, checkpoints and orphan recovery
+
+A backup is committed in this order:
+
+1. the archive is written to ``<name>.tmp`` while ``<name>.lock`` is held,
+   with ``<name>.checkpoint`` recording every member that is safely on disk;
+2. the finished archive is fsynced and renamed to ``<name>``;
+3. ``<name>.meta`` is written atomically - its presence is the commit marker;
+4. the checkpoint and lock are removed.
+
+A crash at any point leaves either a resumable ``.tmp``/``.checkpoint`` pair
+or a complete archive whose checkpoint still holds the metadata to commit.
+"""
+import os
+import json
+import time
+import base64
+import zipfile
+import tempfile
+import logging
+from pathlib import Path
+
+try:
+    import fcntl
+except ImportError:  # not available on Windows
+    fcntl = None
+
+TMP_SUFFIX = ".tmp"
+CHECKPOINT_SUFFIX = ".checkpoint"
+LOCK_SUFFIX = ".lock"
+MANIFEST_SUFFIX = ".manifest.json"
+STALE_TMP_SECONDS = 300
+
+_ZIPINFO_FIELDS = ("compress_type", "create_system", "create_version", "extract_version",
+                   "flag_bits", "internal_attr", "external_attr", "header_offset",
+                   "CRC", "compress_size", "file_size")
+
+
+def fsync_dir(path):
+    """Flush a directory entry so a rename inside it survives a crash"""
+    if os.name != "posix":
+        return
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def fsync_file(f):
+    f.flush()
+    os.fsync(f.fileno())
+
+
+def atomic_write_json(path, data, indent=2):
+    """Write JSON to a unique temp file, fsync it and rename it over path"""
+    path = Path(path)
+    fd, tmp_path = tempfile.mkstemp(dir=path.parent, prefix=f".{path.name}.", suffix=TMP_SUFFIX)
+    try:
+        with os.fdopen(fd, 'w') as f:
+            json.dump(data, f, indent=indent)
+            fsync_file(f)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.unlink(tmp_path)
+        raise
+    fsync_dir(path.parent)
+
+
+def commit_file(tmp_path, final_path):
+    """Atomically publish a fully written and fsynced file"""
+    os.replace(tmp_path, final_path)
+    fsync_dir(Path(final_path).parent)
+
+
+def zipinfo_to_dict(zinfo):
+    """Serialize the central directory entry of a written member"""
+    state = {name: getattr(zinfo, name) for name in _ZIPINFO_FIELDS}
+    state["filename"] = zinfo.filename
+    state["date_time"] = list(zinfo.date_time)
+    state["extra"] = base64.b64encode(zinfo.extra).decode()
+    return state
+
+
+def zipinfo_from_dict(state):
+    zinfo = zipfile.ZipInfo(state["filename"], tuple(state["date_time"]))
+    for name in _ZIPINFO_FIELDS:
+        setattr(zinfo, name, state[name])
+    zinfo.extra = base64.b64decode(state["extra"])
+    return zinfo
+
+
+class RunLock:
+    """Advisory lock held for the lifetime of a backup run.
+
+    The kernel drops the lock when its owner dies, so a lock that can be
+    acquired belongs to a crashed run, regardless of PID reuse.
+    """
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._file = None
+
+    def acquire(self):
+        """Try to take the lock without blocking; returns True on success"""
+        while True:
+            f = open(self.path, 'a+')
+            if fcntl is None:
+                break
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                f.close()
+                return False
+            # Another process may have removed a stale lock file between our
+            # open() and flock(); only a lock on the current file counts.
+            try:
+                if os.stat(self.path).st_ino == os.fstat(f.fileno()).st_ino:
+                    break
+            except FileNotFoundError:
+                pass
+            f.close()
+        f.seek(0)
+        f.truncate()
+        f.write(str(os.getpid()))
+        f.flush()
+        self._file = f
+        return True
+
+    def release(self, remove=True):
+        if self._file is None:
+            return
+        if remove and self.path.exists():
+            self.path.unlink()
+        self._file.close()
+        self._file = None
+
+    @staticmethod
+    def is_held(path):
+        """True if a live run currently owns the lock at path"""
+        path = Path(path)
+        if not path.exists():
+            return False
+        if fcntl is None:
+            return path.read_text().strip() == str(os.getpid())
+        with open(path, 'a+') as f:
+            try:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                return True
+            fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+        return False
+
+
+class BackupCheckpoint:
+    """Append-only journal of an in-progress backup run.
+
+    The first line holds the run's header; each following line records the
+    members made durable since the previous line, the archive offset they end
+    at and the running counters. A torn final line is ignored on load, so the
+    checkpoint always describes the last fully synced state.
+    """
+
+    def __init__(self, backup_path, state):
+        self.backup_path = Path(backup_path)
+        self.path = checkpoint_path(backup_path)
+        self.state = state
+        self._recorded = len(self.entries)
+
+    @classmethod
+    def create(cls, backup_path, header):
+        checkpoint = cls(backup_path, dict(header, entries=[], files={}, offset=0))
+        with open(checkpoint.path, 'w') as f:
+            f.write(json.dumps(header) + "\n")
+            fsync_file(f)
+        fsync_dir(checkpoint.path.parent)
+        return checkpoint
+
+    @classmethod
+    def load(cls, backup_path):
+        state = None
+        with open(checkpoint_path(backup_path), 'r') as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    break
+                if state is None:
+                    state = dict(record, entries=[], files={}, offset=0)
+                    continue
+                state["entries"].extend(record.pop("entries", []))
+                state["files"].update(record.pop("files", {}))
+                state.update(record)
+        if state is None:
+            raise ValueError("Empty checkpoint")
+        return cls(backup_path, state)
+
+    @property
+    def entries(self):
+        return self.state.setdefault("entries", [])
+
+    @property
+    def files(self):
+        """Manifest entries of the members in the checkpoint"""
+        return self.state.setdefault("files", {})
+
+    def _append(self, record):
+        with open(self.path, 'a') as f:
+            f.write(json.dumps(record) + "\n")
+            fsync_file(f)
+
+    def record(self, zipf, counters, files=None):
+        """Make every member written so far durable, then journal them.
+
+        files holds the manifest entries of the members added since the
+        previous record.
+        """
+        fsync_file(zipf.fp)
+        new_entries = [zipinfo_to_dict(info) for info in zipf.infolist()[self._recorded:]]
+        record = dict(counters, offset=zipf.fp.tell(), entries=new_entries, files=files or {})
+        self._append(record)
+        self.entries.extend(new_entries)
+        self.files.update(files or {})
+        self._recorded = len(self.entries)
+        self.state.update(counters, offset=record["offset"])
+
+    def compact(self):
+        """Atomically rewrite the journal as a header plus one record.
+
+        Used when resuming so records appended later never follow a torn line.
+        """
+        header = {k: v for k, v in self.state.items() if k not in ("entries", "files", "offset")}
+        record = {"offset": self.state["offset"], "entries": self.entries, "files": self.files}
+        fd, tmp = tempfile.mkstemp(dir=self.path.parent, prefix=f".{self.path.name}.", suffix=TMP_SUFFIX)
+        with os.fdopen(fd, 'w') as f:
+            f.write(json.dumps(header) + "\n" + json.dumps(record) + "\n")
+            fsync_file(f)
+        commit_file(tmp, self.path)
+
+    def commit(self, metadata):
+        """Journal the final metadata before the archive is published"""
+        self._append({"metadata": metadata})
+        self.state["metadata"] = metadata
+
+    def remove(self):
+        if self.path.exists():
+            self.path.unlink()
+
+
+def tmp_path(backup_path):
+    return Path(f"{backup_path}{TMP_SUFFIX}")
+
+
+def checkpoint_path(backup_path):
+    return Path(f"{backup_path}{CHECKPOINT_SUFFIX}")
+
+
+def lock_path(backup_path):
+    return Path(f"{backup_path}{LOCK_SUFFIX}")
+
+
+def manifest_path(backup_path):
+    return Path(f"{backup_path}{MANIFEST_SUFFIX}")
+
+
+def backup_order(metadata):
+    """Sort key of a backup's .meta: its point in time, a synthetic full one after its source"""
+    return metadata["timestamp"], metadata.get("synthesized_at", "")
+
+
+def reopen_archive(f, checkpoint, compression):
+    """Reopen a partially written archive (opened 'r+b') at the last checkpointed member"""
+    f.truncate(checkpoint.state["offset"])
+    f.seek(checkpoint.state["offset"])
+    zipf = zipfile.ZipFile(f, 'w', compression)
+    for state in checkpoint.entries:
+        zinfo = zipinfo_from_dict(state)
+        zipf.filelist.append(zinfo)
+        zipf.NameToInfo[zinfo.filename] = zinfo
+    return zipf
+
+
+def recover_orphans(backup_dir, keep_resumable=True):
+    """Clean up debris left by interrupted runs in backup_dir.
+
+    Returns a dict with the names of backups that were committed from their
+    checkpoint, kept for resumption, and the paths that were removed.
+    """
+    backup_dir = Path(backup_dir)
+    report = {"committed": [], "resumable": [], "removed": []}
+
+    def remove(path):
+        if path.exists():
+            path.unlink()
+            report["removed"].append(path.name)
+
+    names = set()
+    for pattern in (f"backup_*.zip{TMP_SUFFIX}", f"backup_*.zip{CHECKPOINT_SUFFIX}",
+                    f"backup_*.zip{LOCK_SUFFIX}", f"backup_*.zip{MANIFEST_SUFFIX}"):
+        for path in backup_dir.glob(pattern):
+            names.add(path.name[:path.name.rindex(".zip") + len(".zip")])
+    for path in backup_dir.glob("backup_*.zip"):
+        if not Path(f"{path}.meta").exists():
+            names.add(path.name)
+
+    for name in sorted(names):
+        backup_path = backup_dir / name
+        meta_path = Path(f"{backup_path}.meta")
+        if meta_path.exists() and not (tmp_path(backup_path).exists() or checkpoint_path(backup_path).exists()
+                                       or lock_path(backup_path).exists()):
+            continue
+        if RunLock.is_held(lock_path(backup_path)):
+            continue
+        checkpoint = None
+        if checkpoint_path(backup_path).exists():
+            try:
+                checkpoint = BackupCheckpoint.load(backup_path)
+            except (OSError, ValueError):
+                logging.warning(f"Discarding unreadable checkpoint for {name}")
+
+        if backup_path.exists() and not meta_path.exists():
+            if checkpoint and checkpoint.state.get("metadata"):
+                # Crashed between publishing the archive and writing its .meta
+                atomic_write_json(meta_path, checkpoint.state["metadata"])
+                report["committed"].append(name)
+                logging.info(f"Recovered committed archive from checkpoint: {name}")
+            else:
+                logging.warning(f"Removing archive without metadata: {name}")
+                remove(backup_path)
+                remove(manifest_path(backup_path))
+        elif tmp_path(backup_path).exists() and checkpoint and checkpoint.state.get("metadata"):
+            # Crashed after the archive was finished and synced, before the rename
+            commit_file(tmp_path(backup_path), backup_path)
+            atomic_write_json(meta_path, checkpoint.state["metadata"])
+            report["committed"].append(name)
+            logging.info(f"Recovered committed archive from checkpoint: {name}")
+        elif (tmp_path(backup_path).exists() and checkpoint and keep_resumable
+              and checkpoint.state.get("resumable", True)):
+            report["resumable"].append(name)
+            continue
+        else:
+            remove(tmp_path(backup_path))
+            if not meta_path.exists():
+                remove(manifest_path(backup_path))
+        remove(checkpoint_path(backup_path))
+        remove(lock_path(backup_path))
+
+    cutoff = time.time() - STALE_TMP_SECONDS
+    for path in backup_dir.glob(f".*{TMP_SUFFIX}"):
+        if path.stat().st_mtime < cutoff:
+            remove(path)
+
+    if report["removed"]:
+        logging.info(f"Orphan cleanup removed: {', '.join(report['removed'])}")
+    return report
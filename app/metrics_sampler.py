@@ -0,0 +1,355 @@
+"""Metrics Sampler - One low-overhead host sampler shared by every consumer
+
+A single daemon thread samples CPU, memory and, for the backup and source
+volumes, disk usage plus per-disk read/write throughput and busy time. The
+samples go into a fixed-size ring buffer with one array('d') column per
+metric, so history and percentiles cost a slice and a sort rather than a
+psutil call per caller. The GUI, the web server's /metrics endpoint and the
+backup throttle all read the same buffer.
+"""
+import math
+import os
+import time
+import bisect
+import threading
+from array import array
+from collections import deque
+import psutil
+from config import BACKUP_CONFIG, METRICS_CONFIG, LOG_CONFIG
+from profiler import NULL_TRACER
+from progress import NULL_PROGRESS
+import logging
+
+logging.basicConfig(
+    filename=LOG_CONFIG["log_file"],
+    level=LOG_CONFIG["log_level"],
+    format='%(asctime)s - %(levelname)s - %(message)s'
+)
+
+MB = 1024 * 1024
+VOLUME_FIELDS = ("used_percent", "read_mb_s", "write_mb_s", "busy_percent")
+
+
+class RingBuffer:
+    """Fixed-capacity samples stored column-wise in float arrays (NaN = unknown)"""
+
+    def __init__(self, fields, capacity):
+        self.fields = tuple(fields)
+        self.capacity = capacity
+        self._columns = {field: array('d', [math.nan]) * capacity for field in self.fields}
+        self._next = 0
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, row):
+        """Store one sample given as a dict of field -> value"""
+        with self._lock:
+            for field in self.fields:
+                value = row.get(field)
+                self._columns[field][self._next] = math.nan if value is None else value
+            self._next = (self._next + 1) % self.capacity
+            self._count = min(self._count + 1, self.capacity)
+
+    def _ordered(self, column):
+        """Column values oldest first"""
+        if self._count < self.capacity:
+            return column[:self._count]
+        return column[self._next:] + column[:self._next]
+
+    def columns(self, fields, since=None):
+        """Values of each field oldest first, only those sampled at or after since (epoch seconds)"""
+        with self._lock:
+            start = 0
+            if since is not None:
+                start = bisect.bisect_left(self._ordered(self._columns["time"]), since)
+            return [self._ordered(self._columns[field])[start:] for field in fields]
+
+    def latest(self):
+        with self._lock:
+            if not self._count:
+                return None
+            index = (self._next - 1) % self.capacity
+            return {field: self._columns[field][index] for field in self.fields}
+
+
+def percentile(values, q):
+    """Linearly interpolated percentile of the known values, or None"""
+    known = sorted(value for value in values if not math.isnan(value))
+    if not known:
+        return None
+    position = (len(known) - 1) * q / 100.0
+    lower = int(position)
+    upper = min(lower + 1, len(known) - 1)
+    return known[lower] + (known[upper] - known[lower]) * (position - lower)
+
+
+def _json_value(value, digits=2):
+    return None if value is None or math.isnan(value) else round(value, digits)
+
+
+def _device_of(path, devices):
+    """Name of the block device holding path as it appears in disk_io_counters, or None"""
+    path = os.path.realpath(path)
+    best = None
+    for partition in psutil.disk_partitions(all=True):
+        mountpoint = partition.mountpoint
+        if path == mountpoint or path.startswith(mountpoint.rstrip(os.sep) + os.sep):
+            if best is None or len(mountpoint) > len(best.mountpoint):
+                best = partition
+    if best is None:
+        return None
+    # /dev/mapper/* and /dev/disk/by-* are symlinks to the kernel's name (dm-0, sda1, ...)
+    name = os.path.basename(os.path.realpath(best.device))
+    return name if name in devices else None
+
+
+class MetricsSampler:
+    """Background host sampler; volumes maps a label to the paths it covers"""
+
+    def __init__(self, config=None, volumes=None):
+        self.config = config or METRICS_CONFIG
+        if volumes is None:
+            volumes = {"backup": [BACKUP_CONFIG["backup_location"]], "source": BACKUP_CONFIG["source_dirs"]}
+        self.volumes = {label: [str(path) for path in paths] for label, paths in volumes.items()}
+        fields = ["time", "cpu_percent", "memory_percent"]
+        for label in self.volumes:
+            fields.extend(f"{label}_{field}" for field in VOLUME_FIELDS)
+        self.interval_s = self.config["interval_s"]
+        capacity = max(2, int(self.config["history_s"] / self.interval_s))
+        self.buffer = RingBuffer(fields, capacity)
+        self.boot_time = psutil.boot_time()
+        self._devices = {}
+        self._previous = None
+        self._sample_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+        self._start_lock = threading.Lock()
+
+    def start(self):
+        with self._start_lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._stop.clear()
+                self._resolve_devices()
+                psutil.cpu_percent(interval=None)  # the first call only sets the baseline
+                self._thread = threading.Thread(target=self._run, name="metrics-sampler", daemon=True)
+                self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _run(self):
+        while not self._stop.wait(self.interval_s):
+            try:
+                self.sample()
+            except Exception as e:
+                logging.warning(f"Metrics sample failed: {str(e)}")
+
+    def _resolve_devices(self):
+        """Map each volume label to the distinct block devices under its paths"""
+        counters = psutil.disk_io_counters(perdisk=True) or {}
+        self._devices = {}
+        for label, paths in self.volumes.items():
+            devices = {_device_of(path, counters) for path in paths if os.path.exists(path)}
+            self._devices[label] = sorted(device for device in devices if device)
+            if not self._devices[label]:
+                logging.info(f"No block device statistics for the {label} volume; I/O is not sampled")
+
+    def sample(self):
+        """Take one sample now and store it (callers may add samples between the thread's)"""
+        with self._sample_lock:
+            return self._sample()
+
+    def _sample(self):
+        now = time.time()
+        row = {
+            "time": now,
+            "cpu_percent": psutil.cpu_percent(interval=None),
+            "memory_percent": psutil.virtual_memory().percent,
+        }
+        counters = psutil.disk_io_counters(perdisk=True) or {}
+        previous, self._previous = self._previous, (now, counters)
+        for label, paths in self.volumes.items():
+            used = [psutil.disk_usage(path).percent for path in paths if os.path.exists(path)]
+            row[f"{label}_used_percent"] = max(used) if used else None
+            devices = [device for device in self._devices.get(label, ()) if device in counters]
+            if previous is None or not devices:
+                continue
+            elapsed = now - previous[0]
+            before = previous[1]
+            devices = [device for device in devices if device in before]
+            if elapsed <= 0 or not devices:
+                continue
+            read = sum(counters[d].read_bytes - before[d].read_bytes for d in devices)
+            written = sum(counters[d].write_bytes - before[d].write_bytes for d in devices)
+            row[f"{label}_read_mb_s"] = max(0, read) / MB / elapsed
+            row[f"{label}_write_mb_s"] = max(0, written) / MB / elapsed
+            if hasattr(counters[devices[0]], "busy_time"):  # Linux/FreeBSD only
+                busy_ms = max(counters[d].busy_time - before[d].busy_time for d in devices)
+                row[f"{label}_busy_percent"] = min(100.0, max(0.0, busy_ms / 10.0 / elapsed))
+        self.buffer.append(row)
+        return row
+
+    def latest(self):
+        """The most recent sample as a dict (None for unknown values), or None before the first one"""
+        row = self.buffer.latest()
+        if row is None:
+            return None
+        return {field: None if math.isnan(value) else value for field, value in row.items()}
+
+    def uptime_s(self):
+        return time.time() - self.boot_time
+
+    def history(self, field, seconds=None):
+        """[(time, value)] for one field over the last seconds (or the whole buffer)"""
+        since = time.time() - seconds if seconds is not None else None
+        times, values = self.buffer.columns(("time", field), since)
+        return [(t, None if math.isnan(value) else value) for t, value in zip(times, values)]
+
+    def percentiles(self, field, seconds=None, qs=None):
+        """{"p50": ..., "p95": ...} for one field over the last seconds"""
+        since = time.time() - seconds if seconds is not None else None
+        values, = self.buffer.columns((field,), since)
+        return {f"p{q}": percentile(values, q) for q in (qs or self.config["percentiles"])}
+
+    def health(self):
+        """Headroom left on the host in percent: 100 minus the most loaded resource"""
+        row = self.latest()
+        if row is None:
+            return None
+        loads = [value for field, value in row.items()
+                 if field != "time" and field.endswith("percent") and value is not None]
+        return round(max(0.0, 100.0 - max(loads)), 1) if loads else None
+
+    def summary(self, seconds=None):
+        """JSON-ready latest values and percentiles over the summary window"""
+        seconds = seconds or self.config["summary_window_s"]
+        latest = self.latest()
+        fields = [field for field in self.buffer.fields if field != "time"]
+        return {
+            "sampled_at": latest["time"] if latest else None,
+            "interval_s": self.interval_s,
+            "window_s": seconds,
+            "samples": len(self.buffer),
+            "uptime_s": round(self.uptime_s()),
+            "health": self.health(),
+            "devices": self._devices,
+            "latest": {field: _json_value(latest[field]) if latest and latest[field] is not None else None
+                       for field in fields},
+            "percentiles": {field: {q: _json_value(value) for q, value in
+                                    self.percentiles(field, seconds).items()}
+                            for field in fields},
+        }
+
+
+_shared = None
+_shared_lock = threading.Lock()
+
+
+def shared_sampler():
+    """The process-wide sampler, started on first use"""
+    global _shared
+    with _shared_lock:
+        if _shared is None:
+            _shared = MetricsSampler()
+        return _shared.start()
+
+
+class BackupThrottle:
+    """Slows a backup down while the host is busy, judged from the shared sampler.
+
+    pause() is called between files. It looks at the sampler at most every
+    check_every_s, and while the median CPU or the disk busy time caused by
+    others over the last window_s is above its limit it sleeps in pause_s
+    steps, for at most max_pause_s per call so a backup always makes progress.
+
+    The backup keeps its own disks busy, so busy time is discounted by the
+    run's share of the volume's throughput: the tracer's read bytes count
+    against the source volume, its write bytes against the backup volume
+    (both when they share a disk). Only what is left is compared with
+    io_busy_percent; a run alone on the host never throttles itself.
+    """
+
+    # Tracer phase whose bytes the run moves on each volume
+    OWN_IO_PHASES = {"source": "read", "backup": "write"}
+
+    def __init__(self, config=None, sampler=None):
+        self.config = config or METRICS_CONFIG["throttle"]
+        self.enabled = self.config["enabled"]
+        self._sampler = sampler
+        if self.enabled and sampler is None:
+            self._sampler = shared_sampler()  # start sampling before the first file
+        self._last_check = 0.0
+        self._own_io = deque()
+        self.throttled_s = 0.0
+
+    def _own_mb_s(self, tracer):
+        """The run's own MB/s per phase over the last window_s, from the tracer's byte counts"""
+        phases = getattr(tracer, "phases", {})
+        now = time.monotonic()
+        counts = {phase: phases.get(phase, {}).get("bytes", 0) for phase in set(self.OWN_IO_PHASES.values())}
+        self._own_io.append((now, counts))
+        while len(self._own_io) > 2 and now - self._own_io[1][0] >= self.config["window_s"]:
+            self._own_io.popleft()
+        then, before = self._own_io[0]
+        if now - then <= 0:
+            return {phase: 0.0 for phase in counts}
+        return {phase: (counts[phase] - before[phase]) / MB / (now - then) for phase in counts}
+
+    def _foreign_busy(self, label, busy, own):
+        """Busy percent of a volume left after taking away the run's share of its throughput"""
+        window = self.config["window_s"]
+        total = 0.0
+        for direction in ("read", "write"):
+            rate = self._sampler.percentiles(f"{label}_{direction}_mb_s", window, (50,))["p50"]
+            total += rate or 0.0
+        devices = set(self._sampler._devices.get(label, ()))
+        own_mb_s = sum(own[phase] for other, phase in self.OWN_IO_PHASES.items()
+                       if other == label or devices & set(self._sampler._devices.get(other, ())))
+        if total <= 0:
+            return busy
+        return busy * max(0.0, total - own_mb_s) / total
+
+    def pressure(self, tracer=NULL_TRACER):
+        """Why the host is too busy for the backup right now, or None"""
+        window = self.config["window_s"]
+        own = self._own_mb_s(tracer)
+        cpu = self._sampler.percentiles("cpu_percent", window, (50,))["p50"]
+        if cpu is not None and cpu > self.config["cpu_percent"]:
+            return f"cpu {cpu:.0f}%"
+        for label in self._sampler.volumes:
+            busy = self._sampler.percentiles(f"{label}_busy_percent", window, (50,))["p50"]
+            if busy is None:
+                continue
+            busy = self._foreign_busy(label, busy, own)
+            if busy > self.config["io_busy_percent"]:
+                return f"{label} disk busy {busy:.0f}% (other than this backup)"
+        return None
+
+    def pause(self, progress=NULL_PROGRESS, tracer=NULL_TRACER):
+        """Wait while the host is under pressure; returns the seconds waited"""
+        if not self.enabled:
+            return 0.0
+        now = time.monotonic()
+        if now - self._last_check < self.config["check_every_s"]:
+            return 0.0
+        self._last_check = now
+        reason = self.pressure(tracer)
+        if reason is None:
+            return 0.0
+        logging.info(f"Backup throttled: {reason}")
+        started = time.monotonic()
+        with tracer.measure("throttle"):
+            while reason and time.monotonic() - started < self.config["max_pause_s"]:
+                progress.check_cancelled()
+                time.sleep(self.config["pause_s"])
+                reason = self.pressure(tracer)
+        waited = time.monotonic() - started
+        self._last_check = time.monotonic()
+        self.throttled_s += waited
+        return waited
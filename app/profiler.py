@@ -0,0 +1,261 @@
+"""Run Profiler - Per-phase timing, sampling hooks and Chrome trace export
+
+A RunTracer is created for each backup or restore run. Work is attributed
+to phases (walk, stat, read, compress, write, upload, ...) in two ways:
+
+* span() records a complete event for coarse, non-overlapping steps and for
+  individual large files;
+* add() accumulates time and bytes for hot per-chunk operations, which are
+  too frequent to trace one by one. Cumulative phase totals are emitted as
+  counter events at every checkpoint so they still show up over time.
+
+The trace is written in the Chrome trace-event format (open it in
+chrome://tracing or https://ui.perfetto.dev) next to the backup's .meta.
+"""
+import os
+import json
+import time
+import threading
+import cProfile
+import pstats
+import tracemalloc
+from contextlib import contextmanager
+from pathlib import Path
+from config import PROFILING_CONFIG
+from journal import atomic_write_json
+
+TRACE_SUFFIX = ".trace.json"
+
+
+class RunTracer:
+    """Collects spans and phase totals for a single run"""
+
+    def __init__(self, run_type, name, config=None):
+        self.config = config or PROFILING_CONFIG
+        self.run_type = run_type
+        self.name = name
+        self.events = []
+        self.phases = {}
+        self.large_file_bytes = self.config["large_file_mb"] * 1024 * 1024
+        self._lock = threading.Lock()
+        self._origin = time.perf_counter()
+        self._started_at = time.time()
+        self._pid = os.getpid()
+        self._profile = None
+        self._tracing_memory = False
+        self.summary = None
+
+    def _now_us(self):
+        return (time.perf_counter() - self._origin) * 1e6
+
+    def start(self):
+        """Begin the run, enabling cProfile / tracemalloc if configured"""
+        if self.config["cprofile"]:
+            self._profile = cProfile.Profile()
+            self._profile.enable()
+        if self.config["tracemalloc"] and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self._tracing_memory = True
+        return self
+
+    @contextmanager
+    def span(self, name, cat="phase", **args):
+        """Time a block as a complete trace event and add it to its phase"""
+        start = time.perf_counter()
+        try:
+            yield args
+        finally:
+            elapsed = time.perf_counter() - start
+            with self._lock:
+                self.events.append({
+                    "name": name, "cat": cat, "ph": "X", "pid": self._pid,
+                    "tid": threading.get_ident(),
+                    "ts": (start - self._origin) * 1e6, "dur": elapsed * 1e6,
+                    "args": args,
+                })
+            if cat == "phase":
+                self.add(name, elapsed, args.get("bytes", 0))
+
+    def add(self, phase, seconds, nbytes=0, count=1):
+        """Accumulate time spent in a phase (safe to call from worker threads)"""
+        with self._lock:
+            totals = self.phases.setdefault(phase, {"seconds": 0.0, "bytes": 0, "count": 0})
+            totals["seconds"] += seconds
+            totals["bytes"] += nbytes
+            totals["count"] += count
+
+    @contextmanager
+    def measure(self, phase, nbytes=0):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(phase, time.perf_counter() - start, nbytes)
+
+    def is_large(self, size):
+        return size >= self.large_file_bytes
+
+    @contextmanager
+    def file_span(self, path, size):
+        """Trace a single large file, including how its time split across phases"""
+        if not self.is_large(size):
+            yield
+            return
+        before = self._phase_seconds()
+        with self.span("file", cat="file", path=str(path), size=size) as args:
+            yield
+            after = self._phase_seconds()
+            args["phases_s"] = {p: round(after[p] - before.get(p, 0.0), 6)
+                                for p in after if after[p] != before.get(p, 0.0)}
+
+    def _phase_seconds(self):
+        with self._lock:
+            return {phase: totals["seconds"] for phase, totals in self.phases.items()}
+
+    def counters(self):
+        """Emit the cumulative phase totals as counter events"""
+        with self._lock:
+            self.events.append({
+                "name": "phase_seconds", "ph": "C", "pid": self._pid, "ts": self._now_us(),
+                "args": {phase: round(totals["seconds"], 6) for phase, totals in self.phases.items()},
+            })
+
+    def finish(self, **extra):
+        """Stop sampling and build the run summary"""
+        wall = time.perf_counter() - self._origin
+        summary = {
+            "run_type": self.run_type,
+            "name": self.name,
+            "started_at": self._started_at,
+            "wall_s": round(wall, 4),
+            "phases": {phase: {"seconds": round(t["seconds"], 4), "bytes": t["bytes"], "count": t["count"]}
+                       for phase, t in sorted(self.phases.items(), key=lambda kv: -kv[1]["seconds"])},
+            "large_files": sum(1 for e in self.events if e.get("cat") == "file"),
+        }
+        summary.update(extra)
+        if summary.get("bytes") and wall > 0:
+            summary["throughput_mb_s"] = round(summary["bytes"] / (1024 * 1024) / wall, 2)
+        if self._profile is not None:
+            self._profile.disable()
+            summary["cprofile_top"] = self._cprofile_top()
+            self._profile = None
+        if self._tracing_memory:
+            current, peak = tracemalloc.get_traced_memory()
+            summary["peak_memory_mb"] = round(peak / (1024 * 1024), 2)
+            summary["tracemalloc_top"] = [
+                {"where": str(stat.traceback), "size_kb": round(stat.size / 1024, 1)}
+                for stat in tracemalloc.take_snapshot().statistics("lineno")[:self.config["top_n"]]
+            ]
+            tracemalloc.stop()
+            self._tracing_memory = False
+        self.counters()
+        self.summary = summary
+        return summary
+
+    def _cprofile_top(self):
+        stats = pstats.Stats(self._profile)
+        top = []
+        for (filename, line, func), (cc, nc, tt, ct, callers) in sorted(
+                stats.stats.items(), key=lambda kv: -kv[1][3])[:self.config["top_n"]]:
+            top.append({"function": f"{Path(filename).name}:{line}({func})",
+                        "calls": nc, "tottime_s": round(tt, 4), "cumtime_s": round(ct, 4)})
+        return top
+
+    def write_trace(self, path):
+        """Write the Chrome trace-event JSON; returns the path written"""
+        path = Path(path)
+        trace = {
+            "traceEvents": [
+                {"name": "process_name", "ph": "M", "pid": self._pid,
+                 "args": {"name": f"{self.run_type}: {self.name}"}},
+            ] + self.events,
+            "displayTimeUnit": "ms",
+            "otherData": {"summary": self.summary},
+        }
+        atomic_write_json(path, trace, indent=None)
+        return path
+
+
+class NullTracer:
+    """Stand-in used when a caller does not trace; every hook is a no-op"""
+
+    @contextmanager
+    def measure(self, phase, nbytes=0):
+        yield
+
+    @contextmanager
+    def span(self, name, cat="phase", **args):
+        yield args
+
+    def add(self, phase, seconds, nbytes=0, count=1):
+        pass
+
+
+NULL_TRACER = NullTracer()
+
+
+class TimedFile:
+    """File wrapper that attributes time spent in write() to a phase.
+
+    `elapsed` lets a caller subtract the disk time from an enclosing
+    measurement (e.g. compress + write inside ZipFile).
+    """
+
+    def __init__(self, f, tracer, phase="write"):
+        self._f = f
+        self._tracer = tracer
+        self._phase = phase
+        self.elapsed = 0.0
+
+    def write(self, data):
+        start = time.perf_counter()
+        written = self._f.write(data)
+        elapsed = time.perf_counter() - start
+        self.elapsed += elapsed
+        self._tracer.add(self._phase, elapsed, len(data))
+        return written
+
+    def __getattr__(self, name):
+        return getattr(self._f, name)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return self._f.__exit__(*exc)
+
+
+def trace_path(backup_path, run_type="backup"):
+    suffix = TRACE_SUFFIX if run_type == "backup" else f".{run_type}{TRACE_SUFFIX}"
+    return Path(f"{backup_path}{suffix}")
+
+
+def latest_summary(backup_dir, run_type=None):
+    """Summary of the most recent traced run found in backup_dir"""
+    traces = sorted(Path(backup_dir).glob(f"backup_*{TRACE_SUFFIX}"),
+                    key=lambda p: p.stat().st_mtime, reverse=True)
+    for path in traces:
+        try:
+            with open(path, 'r') as f:
+                summary = json.load(f)["otherData"]["summary"]
+        except (OSError, ValueError, KeyError, TypeError):
+            continue
+        if run_type is None or summary.get("run_type") == run_type:
+            return summary
+    return None
+
+
+def format_summary(summary):
+    """Human readable lines for consoles and logs"""
+    lines = [f"⏱️  {summary['run_type'].title()} profile: {summary['name']} "
+             f"({summary['wall_s']:.2f}s wall"
+             + (f", {summary['throughput_mb_s']} MB/s" if "throughput_mb_s" in summary else "") + ")"]
+    for phase, totals in summary["phases"].items():
+        share = totals["seconds"] / summary["wall_s"] * 100 if summary["wall_s"] else 0
+        lines.append(f"   {phase:<10} {totals['seconds']:>9.3f}s  {share:5.1f}%  "
+                     f"{totals['bytes'] / (1024 * 1024):>9.2f} MB  x{totals['count']}")
+    if summary.get("large_files"):
+        lines.append(f"   large files traced: {summary['large_files']}")
+    if "peak_memory_mb" in summary:
+        lines.append(f"   peak traced memory: {summary['peak_memory_mb']} MB")
+    return lines
@@ -0,0 +1,126 @@
+"""Progress Reporting - Live counters and cancellation for long-running runs
+
+The archiver and the restorer call advance() after every chunk they move,
+so progress stays live inside multi-GB files, and advance() is also where a
+cancelled run stops: it raises JobCancelled on the worker's own thread.
+"""
+import time
+import threading
+from collections import deque
+
+THROUGHPUT_WINDOW_S = 5.0
+_SAMPLE_EVERY_S = 0.25
+
+
+class JobCancelled(Exception):
+    """Raised inside a run whose job was cancelled"""
+
+
+class Progress:
+    """Thread-safe files/bytes counters with throughput and ETA"""
+
+    def __init__(self, cancel_event=None):
+        self.cancel_event = cancel_event or threading.Event()
+        self.phase = "queued"
+        self.files_done = 0
+        self.files_total = None
+        self.bytes_done = 0
+        self.bytes_total = None
+        self.current = None
+        self._lock = threading.Lock()
+        self._started = None
+        self._samples = deque()
+
+    def start(self, phase):
+        with self._lock:
+            if self._started is None:
+                self._started = time.monotonic()
+                self._samples.append((self._started, self.bytes_done))
+            self.phase = phase
+        self.check_cancelled()
+
+    def set_phase(self, phase, current=None):
+        with self._lock:
+            self.phase = phase
+            self.current = current
+        self.check_cancelled()
+
+    def set_totals(self, files, nbytes, files_done=0, bytes_done=0):
+        """Declare the amount of work; *_done count work finished by an earlier attempt"""
+        with self._lock:
+            self.files_total = files
+            self.bytes_total = nbytes
+            self.files_done = files_done
+            self.bytes_done = bytes_done
+            self._samples.clear()
+            self._samples.append((time.monotonic(), bytes_done))
+
+    def advance(self, files=0, nbytes=0, current=None):
+        """Count finished work; raises JobCancelled if the run was cancelled"""
+        now = time.monotonic()
+        with self._lock:
+            self.files_done += files
+            self.bytes_done += nbytes
+            if current is not None:
+                self.current = current
+            if not self._samples or now - self._samples[-1][0] >= _SAMPLE_EVERY_S:
+                self._samples.append((now, self.bytes_done))
+                while len(self._samples) > 2 and now - self._samples[0][0] > THROUGHPUT_WINDOW_S:
+                    self._samples.popleft()
+        self.check_cancelled()
+
+    def check_cancelled(self):
+        if self.cancel_event.is_set():
+            raise JobCancelled("Cancelled")
+
+    def snapshot(self):
+        """JSON-ready view of the counters"""
+        now = time.monotonic()
+        with self._lock:
+            throughput = None
+            if len(self._samples) > 1 or (self._samples and now > self._samples[0][0]):
+                first_t, first_b = self._samples[0]
+                if now - first_t > 0:
+                    throughput = (self.bytes_done - first_b) / (now - first_t)
+            eta = None
+            if throughput and self.bytes_total is not None:
+                eta = max(0.0, (self.bytes_total - self.bytes_done) / throughput)
+            percent = None
+            if self.bytes_total:
+                percent = round(100.0 * self.bytes_done / self.bytes_total, 1)
+            elif self.files_total:
+                percent = round(100.0 * self.files_done / self.files_total, 1)
+            return {
+                "phase": self.phase,
+                "current": self.current,
+                "files_done": self.files_done,
+                "files_total": self.files_total,
+                "bytes_done": self.bytes_done,
+                "bytes_total": self.bytes_total,
+                "percent": percent,
+                "throughput_mb_s": round(throughput / (1024 * 1024), 2) if throughput is not None else None,
+                "eta_s": round(eta, 1) if eta is not None else None,
+                "elapsed_s": round(now - self._started, 1) if self._started else 0.0,
+            }
+
+
+class NullProgress:
+    """Stand-in used when a caller does not report progress"""
+
+    def start(self, phase):
+        pass
+
+    def set_phase(self, phase, current=None):
+        pass
+
+    def set_totals(self, files, nbytes, files_done=0, bytes_done=0):
+        pass
+
+    def advance(self, files=0, nbytes=0, current=None):
+        pass
+
+    def check_cancelled(self):
+        pass
+
+
+NULL_PROGRESS = NullProgress()
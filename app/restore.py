@@ -1,8 +1,17 @@
 """Restore Module"""
+import os
 import zipfile
-import json
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
-from config import BACKUP_CONFIG, LOG_CONFIG
+from config import BACKUP_CONFIG, LOG_CONFIG, ENCRYPTION_CONFIG, PROFILING_CONFIG, RESTORE_CONFIG
+from cloud_simulator import CloudStorageSimulator
+from encryption import BackupCipher
+from progress import NULL_PROGRESS, JobCancelled
+import archive
+import cloud_reader
+import profiler
+import restore_planner
 import logging
 
 logging.basicConfig(
@@ -12,45 +21,246 @@ logging.basicConfig(
 )
 
 class RestoreSystem:
-    def __init__(self):
-        self.config = BACKUP_CONFIG
+    def __init__(self, config=None, cloud_config=None):
+        self.config = config or BACKUP_CONFIG
         self.backup_dir = Path(self.config["backup_location"])
+        self.catalog = restore_planner.BackupCatalog(self.backup_dir)
+        self.cloud = CloudStorageSimulator(cloud_config)
+        self.last_profile = None
+
+    def restore_backup(self, backup_name, restore_location=None, paths=None,
+                       in_place=False, delete_extras=False, checksum=None, progress=None):
+        """Restore a specific backup.
+
+        For an incremental backup the whole chain is resolved first, and every
+        file is extracted once, from the archive holding its latest version.
+        paths optionally limits the restore to files or directories.
+
+        With in_place=True the backup is applied to an existing tree - the
+        original source directories unless restore_location is given. Only
+        files whose size, mtime or hash differ from the backup are rewritten
+        (temp file + atomic rename); checksum=True (default:
+        RESTORE_CONFIG["verify_checksums"]) hashes files even when size and
+        mtime match. delete_extras removes files the backup does not contain.
         
-    def restore_backup(self, backup_name, restore_location=None):
-        """Restore a specific backup"""
+        progress (a progress.Progress) receives live file and byte counts;
+        cancelling it stops the restore between chunks. Files already
+        restored are kept, the one in flight is never left half-written.
+        """
+        return self._restore(self.catalog, backup_name, restore_location, paths,
+                             in_place, delete_extras, checksum, progress)
+
+    def restore_from_cloud(self, backup_name, restore_location=None, paths=None,
+                           in_place=False, delete_extras=False, checksum=None, progress=None):
+        """Restore a backup straight from cloud storage, e.g. after losing backups/.
+
+        Takes the same options as restore_backup. Archives are never
+        downloaded whole: only their central directories and the members
+        being restored are fetched, with parallel range requests through an
+        on-disk block cache (CLOUD_CONFIG) that later restores reuse.
+        """
+        catalog = cloud_reader.CloudCatalog(self.cloud, self.cloud.config)
+        try:
+            return self._restore(catalog, backup_name, restore_location, paths,
+                                 in_place, delete_extras, checksum, progress)
+        finally:
+            catalog.close()
+
+    def _restore(self, catalog, backup_name, restore_location, paths, in_place, delete_extras, checksum,
+                 progress):
+        progress = progress or NULL_PROGRESS
         try:
+            progress.start("planning")
             backup_path = self.backup_dir / backup_name
-            
-            if not backup_path.exists():
+
+            if not catalog.exists(backup_name):
                 logging.error(f"Backup not found: {backup_name}")
                 return False
-            
-            metadata_path = backup_path.with_suffix('.zip.meta')
-            metadata = {}
-            if metadata_path.exists():
-                with open(metadata_path, 'r') as f:
-                    metadata = json.load(f)
-            
-            if restore_location is None:
+
+            metadata = catalog.load_meta(backup_name)
+
+            if restore_location is None and not in_place:
                 timestamp = metadata.get("timestamp", "unknown")
                 restore_location = Path(self.config["backup_location"]).parent / f"restored_{timestamp}"
-            else:
+            if restore_location is not None:
                 restore_location = Path(restore_location)
-            
-            restore_location.mkdir(parents=True, exist_ok=True)
-            
-            logging.info(f"Starting restore: {backup_name} to {restore_location}")
+                restore_location.mkdir(parents=True, exist_ok=True)
+            resolve = self._target_resolver(metadata, restore_location)
+            if checksum is None:
+                checksum = RESTORE_CONFIG["verify_checksums"]
+
+            target_desc = restore_location or "original location (in place)"
+            logging.info(f"Starting restore: {backup_name} to {target_desc}")
             print(f"♻️  Restoring backup: {backup_name}")
-            
-            with zipfile.ZipFile(backup_path, 'r') as zipf:
-                zipf.extractall(restore_location)
-                total_files = len(zipf.namelist())
-            
+            tracer = profiler.RunTracer("restore", backup_name).start()
+
+            with tracer.span("plan"):
+                plan = restore_planner.plan_restore(catalog, backup_name, paths)
+            if in_place:
+                plan = self._without_databases(plan)
+            if len(plan.chain) > 1:
+                print(f"   Chain of {len(plan.chain)} backups, reading from {len(plan.by_archive())} archives")
+            to_write = plan
+            if in_place:
+                progress.set_phase("comparing")
+                with tracer.span("compare", cat="step"):
+                    to_write = self._delta_plan(plan, resolve, checksum, tracer)
+                print(f"   In place: {len(to_write)} of {len(plan)} files differ")
+            progress.set_totals(len(to_write), to_write.total_bytes)
+            progress.set_phase("extracting")
+            with tracer.span("extract", cat="step"):
+                total_bytes = self._materialize(catalog, to_write, resolve, tracer, progress)
+            deleted = 0
+            if delete_extras:
+                progress.check_cancelled()
+                progress.set_phase("deleting")
+                with tracer.span("delete_extras"):
+                    deleted = self._delete_extras(plan, resolve, paths)
+                print(f"   Removed {deleted} files not in the backup")
+            total_files = len(to_write)
+
+            summary = tracer.finish(files=total_files, bytes=total_bytes, chain_length=len(plan.chain),
+                                    files_in_backup=len(plan), files_unchanged=len(plan) - len(to_write),
+                                    files_deleted=deleted, **catalog.stats())
+            if PROFILING_CONFIG["write_trace"]:
+                self.backup_dir.mkdir(parents=True, exist_ok=True)
+                tracer.write_trace(profiler.trace_path(backup_path, "restore"))
+            self.last_profile = summary
+
             logging.info(f"Restore completed: {total_files} files restored")
             print(f"✅ Restore completed: {total_files} files")
             return True
-            
+
+        except JobCancelled:
+            logging.warning(f"Restore cancelled: {backup_name}")
+            print("🛑 Restore cancelled")
+            return False
         except Exception as e:
             logging.error(f"Restore failed: {str(e)}")
             print(f"❌ Restore failed: {str(e)}")
-            return False
\ No newline at end of file
+            return False
+
+    def _target_resolver(self, metadata, restore_location):
+        """Map archive member names to paths on disk.
+
+        Members are stored relative to the parent of their source directory.
+        An in-place restore puts each top-level directory back into the
+        configured source directory of the same name; the absolute paths
+        recorded in .meta only name the directories and are never created.
+        """
+        if restore_location is not None:
+            return lambda arcname: archive.safe_join(restore_location, arcname)
+        roots = {Path(d).name: Path(d).parent for d in self.config["source_dirs"]}
+        unknown = sorted(Path(d).name for d in metadata.get("source_dirs", []) if Path(d).name not in roots)
+        if unknown:
+            raise ValueError(f"Backup sources not configured here: {', '.join(unknown)} "
+                             f"(restore them to a location instead)")
+
+        def resolve(arcname):
+            top = arcname.split("/", 1)[0]
+            if top not in roots:
+                raise ValueError(f"No configured source directory for {arcname}")
+            return archive.safe_join(roots[top], arcname)
+        return resolve
+
+    def _without_databases(self, plan):
+        """Drop database snapshots: they are restored to a location, never over a live database"""
+        skipped = {arcname for arcname, (owner, entry) in plan.owners.items() if entry.get("database")}
+        if not skipped:
+            return plan
+        print(f"   Skipping {len(skipped)} database snapshots (restore them to a location instead)")
+        logging.info(f"In-place restore skips database snapshots: {', '.join(sorted(skipped))}")
+        owners = {arcname: owner for arcname, owner in plan.owners.items() if arcname not in skipped}
+        return restore_planner.RestorePlan(plan.backup_name, plan.chain, owners)
+
+    def _delta_plan(self, plan, resolve, checksum, tracer):
+        """Reduce a plan to the files whose on-disk copy differs from the backup"""
+        def differs(item):
+            arcname, (owner, entry) = item
+            target = resolve(arcname)
+            with tracer.measure("stat"):
+                try:
+                    stat = target.stat()
+                except FileNotFoundError:
+                    return True
+            if not entry.get("sha256") or stat.st_size != entry.get("size"):
+                return True
+            mtime_ns = entry.get("mtime_ns")
+            if stat.st_mtime_ns == mtime_ns and not checksum:
+                return False
+            if archive.hash_file(target, tracer) != entry["sha256"]:
+                return True
+            if mtime_ns is not None and stat.st_mtime_ns != mtime_ns:
+                os.utime(target, ns=(mtime_ns, mtime_ns))
+            return False
+
+        items = list(plan.owners.items())
+        with ThreadPoolExecutor(max_workers=RESTORE_CONFIG["workers"]) as pool:
+            flags = list(pool.map(differs, items))
+        changed = {arcname: owner for (arcname, owner), flag in zip(items, flags) if flag}
+        return restore_planner.RestorePlan(plan.backup_name, plan.chain, changed)
+
+    def _delete_extras(self, plan, resolve, paths):
+        """Remove files below the restored directories that the backup does not contain"""
+        prefixes = {p.rstrip("/") for p in paths} if paths else {a.split("/", 1)[0] for a in plan.owners}
+        deleted = 0
+        for prefix in prefixes:
+            root = resolve(prefix)
+            if not root.is_dir():
+                continue
+            for dirpath, dirs, files in os.walk(root, topdown=False):
+                for file in files:
+                    path = Path(dirpath) / file
+                    arcname = f"{prefix}/{path.relative_to(root).as_posix()}"
+                    if arcname not in plan.owners:
+                        path.unlink()
+                        deleted += 1
+                if Path(dirpath) != root and not os.listdir(dirpath):
+                    os.rmdir(dirpath)
+        return deleted
+
+    def _materialize(self, catalog, plan, resolve, tracer, progress=NULL_PROGRESS):
+        """Extract every planned file once, in parallel batches per owning archive"""
+        workers = RESTORE_CONFIG["workers"]
+        tasks = []
+        ciphers = {}
+        for owner, files in plan.by_archive().items():
+            encryption = catalog.load_meta(owner).get("encryption")
+            by_key = defaultdict(list)
+            for arcname, entry in files:
+                by_key[restore_planner.entry_key_id(encryption, entry)].append((arcname, entry))
+            for data_key_id, files in by_key.items():
+                if data_key_id is not None and data_key_id not in ciphers:
+                    ciphers[data_key_id] = BackupCipher.from_metadata(encryption, data_key_id=data_key_id)
+                cipher = ciphers.get(data_key_id)
+                files = sorted(files)
+                batch_size = max(1, -(-len(files) // (workers * 4)))
+                for start in range(0, len(files), batch_size):
+                    tasks.append((owner, cipher, files[start:start + batch_size]))
+
+        # Chunk decryption gets its own pool so batch workers never wait on their own pool
+        with ThreadPoolExecutor(max_workers=workers) as pool, \
+                ThreadPoolExecutor(max_workers=ENCRYPTION_CONFIG["workers"]) as chunk_pool:
+            futures = [pool.submit(self._extract_batch, catalog, owner, cipher, files, resolve, chunk_pool,
+                                   tracer, progress)
+                       for owner, cipher, files in tasks]
+            return sum(future.result() for future in futures)
+
+    def _extract_batch(self, catalog, owner, cipher, files, resolve, chunk_pool, tracer,
+                       progress=NULL_PROGRESS):
+        """Extract some members of one archive through a private ZipFile handle"""
+        total = 0
+        window = 2 * ENCRYPTION_CONFIG["workers"]
+        catalog.prefetch(owner, [arcname for arcname, entry in files])
+        with catalog.open_archive(owner) as f, zipfile.ZipFile(f, 'r') as zipf:
+            for arcname, entry in files:
+                info = zipf.getinfo(arcname)
+                if cipher:
+                    chunks = archive.iter_sealed_member(zipf, arcname, cipher, chunk_pool, window, tracer)
+                else:
+                    chunks = archive.iter_member(zipf, info, tracer)
+                with tracer.file_span(arcname, info.file_size):
+                    total += archive.restore_member(info, resolve(arcname), chunks, tracer,
+                                                    mtime_ns=entry.get("mtime_ns"), progress=progress)
+                progress.advance(files=1, current=arcname)
+        return total
@@ -0,0 +1,148 @@
+"""Restore Planner - Resolves backup chains into one extraction per file
+
+Every backup has a manifest listing the files whose data it holds and the
+files deleted since its base backup (tombstones). An incremental backup
+only holds what changed, so restoring it means overlaying the manifests of
+its chain, oldest first. The planner does that overlay on metadata alone
+and yields, for each surviving path, the single archive that owns its
+latest version - so each file is extracted exactly once.
+"""
+import json
+import zipfile
+from collections import defaultdict
+from pathlib import Path
+import journal
+
+
+class ChainError(Exception):
+    """Raised when a backup chain is broken or cyclic"""
+
+
+class BackupCatalog:
+    """Reads committed backup metadata and manifests from a backup directory.
+
+    Subclasses serving other storage (see cloud_reader.CloudCatalog) override
+    exists(), open_archive() and _read_json().
+    """
+
+    def __init__(self, backup_dir):
+        self.backup_dir = Path(backup_dir)
+        self._manifests = {}
+
+    def _archive_path(self, backup_name):
+        return self.backup_dir / backup_name
+
+    def exists(self, backup_name):
+        return self._archive_path(backup_name).exists()
+
+    def open_archive(self, backup_name):
+        """Seekable binary file object of an archive"""
+        return open(self._archive_path(backup_name), 'rb')
+
+    def prefetch(self, backup_name, arcnames):
+        """Hint that these members are about to be read; local archives need nothing"""
+
+    def stats(self):
+        """Storage counters for run summaries"""
+        return {}
+
+    def _read_json(self, filename):
+        path = self.backup_dir / filename
+        if not path.exists():
+            return None
+        with open(path, 'r') as f:
+            return json.load(f)
+
+    def load_meta(self, backup_name):
+        return self._read_json(f"{backup_name}.meta") or {}
+
+    def load_manifest(self, backup_name):
+        """Manifest of a backup; synthesized from the ZIP listing for legacy backups"""
+        if backup_name in self._manifests:
+            return self._manifests[backup_name]
+        manifest = self._read_json(journal.manifest_path(Path(backup_name)).name)
+        if manifest is None:
+            manifest = self._legacy_manifest(backup_name)
+        self._manifests[backup_name] = manifest
+        return manifest
+
+    def _legacy_manifest(self, backup_name):
+        encrypted = bool(self.load_meta(backup_name).get("encryption"))
+        with self.open_archive(backup_name) as f, zipfile.ZipFile(f, 'r') as zipf:
+            files = {info.filename: {"size": None if encrypted else info.file_size}
+                     for info in zipf.infolist() if not info.is_dir()}
+        return {"backup_name": backup_name, "base_backup": None, "files": files, "deleted": []}
+
+    def chain(self, backup_name):
+        """Backup names from the full backup up to backup_name, oldest first"""
+        chain = []
+        seen = set()
+        name = backup_name
+        while name:
+            if name in seen:
+                raise ChainError(f"Cyclic backup chain at {name}")
+            if not self.exists(name):
+                raise ChainError(f"Backup {backup_name} depends on missing backup {name}")
+            seen.add(name)
+            chain.append(name)
+            name = self.load_manifest(name).get("base_backup")
+        chain.reverse()
+        return chain
+
+
+class RestorePlan:
+    """Where to read each file of a point-in-time restore from"""
+
+    def __init__(self, backup_name, chain, owners):
+        self.backup_name = backup_name
+        self.chain = chain
+        # arcname -> (owning backup name, manifest entry)
+        self.owners = owners
+
+    def by_archive(self):
+        """Group the files by owning archive: {backup_name: [(arcname, entry), ...]}"""
+        groups = defaultdict(list)
+        for arcname, (owner, entry) in self.owners.items():
+            groups[owner].append((arcname, entry))
+        return dict(groups)
+
+    @property
+    def total_bytes(self):
+        return sum(entry.get("size") or 0 for owner, entry in self.owners.values())
+
+    def __len__(self):
+        return len(self.owners)
+
+
+def entry_key_id(encryption_meta, entry):
+    """Data key id a member was sealed with, or None for a plain member.
+
+    Synthetic full backups hold members sealed under several data keys and
+    record the key per manifest entry; other archives use their own key.
+    """
+    if not encryption_meta:
+        return None
+    return entry.get("key_id", encryption_meta["data_key_id"])
+
+
+def resolve_state(catalog, backup_name):
+    """Overlay the chain's manifests: {arcname: (owner, entry)} as of backup_name"""
+    chain = catalog.chain(backup_name)
+    owners = {}
+    for name in chain:
+        manifest = catalog.load_manifest(name)
+        for arcname in manifest.get("deleted", []):
+            owners.pop(arcname, None)
+        for arcname, entry in manifest["files"].items():
+            owners[arcname] = (name, entry)
+    return chain, owners
+
+
+def plan_restore(catalog, backup_name, paths=None):
+    """Plan a restore of backup_name, optionally limited to paths (files or directory prefixes)"""
+    chain, owners = resolve_state(catalog, backup_name)
+    if paths:
+        prefixes = [p.rstrip("/") for p in paths]
+        owners = {arcname: owner for arcname, owner in owners.items()
+                  if any(arcname == p or arcname.startswith(p + "/") for p in prefixes)}
+    return RestorePlan(backup_name, chain, owners)
@@ -7,14 +7,16 @@ from pathlib import Path
 import threading
 import time
 import datetime
-import psutil # For system monitoring
 
 sys.path.insert(0, str(Path(__file__).parent.parent / "app"))
 
 from backup import BackupSystem
 from restore import RestoreSystem
 from cloud_simulator import CloudStorageSimulator
+from disaster_drill import DisasterDrill, DISASTER_SCENARIOS
 from config import TERRAFORM_CONFIG, JENKINS_CONFIG, LOG_CONFIG
+import metrics_sampler
+import profiler
 
 # Configure logging for the GUI
 import logging
@@ -92,6 +94,7 @@ class BackupDashboard:
         self.create_button(parent, "Destroy Server (Total Loss)", lambda: self.simulate_disaster("Total Loss"), '#C0392B')
         self.create_button(parent, "Data Corruption", lambda: self.simulate_disaster("Data Corruption"), '#8E44AD')
         self.create_button(parent, "Emergency Recovery", self.emergency_recovery, '#2ECC71')
+        self.create_button(parent, "Run Disaster Drill (RTO/RPO)", self.run_disaster_drill, '#1ABC9C')
 
         self.create_section(parent, "⚙️ Automation")
         self.auto_backup_button = self.create_button(parent, "Enable Auto-Backup", self.toggle_auto_backup, '#34495E')
@@ -128,6 +131,7 @@ class BackupDashboard:
         self.disk_progress = ttk.Progressbar(monitor_frame, orient="horizontal", length=200, mode="determinate")
         self.disk_progress.pack(fill=tk.X, padx=5, pady=2)
 
+        self.io_label = self.create_monitor_label(monitor_frame, "Disk I/O:")
         self.uptime_label = self.create_monitor_label(monitor_frame, "Uptime:")
         self.disaster_state_label = self.create_monitor_label(monitor_frame, "Disaster State:")
         self.system_health_label = self.create_monitor_label(monitor_frame, "System Health:")
@@ -185,41 +189,50 @@ class BackupDashboard:
         
         self.root.update_idletasks() # Update GUI immediately
     
+    def log_profile(self, summary):
+        """Show a run's per-phase timing summary in the console"""
+        if summary:
+            for line in profiler.format_summary(summary):
+                self.log(line)
+    
     def update_status(self, message, bg='#27AE60'):
         """Update status bar"""
         self.status_bar.config(text=message, bg=bg)
         self.root.update_idletasks() # Update GUI immediately
     
     def start_system_monitor(self):
-        """Start a thread to monitor system resources"""
-        def monitor():
-            while True:
-                self.update_system_stats()
-                time.sleep(1) # Update every second
-        
-        monitor_thread = threading.Thread(target=monitor, daemon=True)
-        monitor_thread.start()
+        """Show the shared metrics sampler's readings, refreshed on the Tk event loop"""
+        self.sampler = metrics_sampler.shared_sampler()
+        self.update_system_stats()
 
     def update_system_stats(self):
-        """Fetch and update system resource statistics"""
-        cpu_percent = psutil.cpu_percent(interval=None)
-        mem_info = psutil.virtual_memory()
-        disk_info = psutil.disk_usage('/')
-        
-        boot_time_timestamp = psutil.boot_time()
-        boot_time_datetime = datetime.datetime.fromtimestamp(boot_time_timestamp)
-        uptime = datetime.datetime.now() - boot_time_datetime
+        """Update system resource statistics from the latest sample"""
+        self.root.after(int(self.sampler.interval_s * 1000), self.update_system_stats)
+        sample = self.sampler.latest()
+        if sample is None:
+            return
+        cpu_percent = sample["cpu_percent"]
+        mem_percent = sample["memory_percent"]
+        disk_percent = sample["backup_used_percent"] or 0.0
+        uptime = datetime.timedelta(seconds=int(self.sampler.uptime_s()))
 
         self.cpu_label.config(text=f"CPU Usage: {cpu_percent:.1f}%")
         self.cpu_progress["value"] = cpu_percent
 
-        self.mem_label.config(text=f"Memory Usage: {mem_info.percent:.1f}%")
-        self.mem_progress["value"] = mem_info.percent
+        self.mem_label.config(text=f"Memory Usage: {mem_percent:.1f}%")
+        self.mem_progress["value"] = mem_percent
 
-        self.disk_label.config(text=f"Disk Usage: {disk_info.percent:.1f}%")
-        self.disk_progress["value"] = disk_info.percent
+        self.disk_label.config(text=f"Disk Usage: {disk_percent:.1f}%")
+        self.disk_progress["value"] = disk_percent
 
-        self.uptime_label.config(text=f"Uptime: {str(uptime).split('.')[0]}") # Remove microseconds
+        if sample["source_read_mb_s"] is not None or sample["backup_write_mb_s"] is not None:
+            cpu_p95 = self.sampler.percentiles("cpu_percent", 60, (95,))["p95"]
+            self.io_label.config(text=f"Disk I/O: source read {sample['source_read_mb_s'] or 0.0:.1f} MB/s, "
+                                      f"backup write {sample['backup_write_mb_s'] or 0.0:.1f} MB/s "
+                                      f"(CPU p95 1 min: {cpu_p95 or 0.0:.0f}%)")
+        else:
+            self.io_label.config(text="Disk I/O: not available for these volumes")
+        self.uptime_label.config(text=f"Uptime: {uptime}")
         self.disaster_state_label.config(text=f"Disaster State: {self.disaster_state}")
         self.system_health_label.config(text=f"System Health: {self.system_health:.1f}%")
 
@@ -274,6 +287,7 @@ class BackupDashboard:
                 self.log(f"   Files: {metadata['total_files']}")
                 self.log(f"   Size: {metadata['total_size_mb']} MB")
                 self.log("☁️  Uploaded to cloud")
+                self.log_profile(self.backup_system.last_profile)
                 self.backups_created_session += 1
                 self.update_status("Backup completed", '#27AE60')
                 self.refresh_dashboard()
@@ -336,17 +350,28 @@ class BackupDashboard:
         """Action to trigger restore from UI"""
         self.view_backups()
     
-    def restore_specific_backup(self, backup_name):
-        """Restore specific backup"""
+    def restore_specific_backup(self, backup_name, in_place=False, from_cloud=False, checksum=None):
+        """Restore specific backup (in place: rewrite only damaged files in the source dirs).
+        
+        checksum=True hashes every file, catching corruption that kept size and mtime.
+        """
         self.update_status("Restoring...", '#F39C12')
         self.log("=" * 60)
-        self.log(f"♻️  RESTORING: {backup_name}")
+        self.log(f"♻️  RESTORING{' IN PLACE' if in_place else ''}{' FROM CLOUD' if from_cloud else ''}: {backup_name}")
         self.log("=" * 60)
         
         def restore():
-            success = self.restore_system.restore_backup(backup_name)
+            restore_fn = self.restore_system.restore_from_cloud if from_cloud else self.restore_system.restore_backup
+            success = restore_fn(backup_name, in_place=in_place, checksum=checksum)
             if success:
                 self.log("✅ Restore complete!")
+                profile = self.restore_system.last_profile
+                if in_place:
+                    self.log(f"   Repaired {profile['files']} files, {profile['files_unchanged']} already intact")
+                if from_cloud:
+                    self.log(f"   Downloaded {profile['downloaded_bytes'] / (1024 * 1024):.2f} MB in "
+                             f"{profile['range_requests']} range requests, {profile['cache_hits']} cached blocks")
+                self.log_profile(self.restore_system.last_profile)
                 self.restores_completed_session += 1
                 self.system_health = 100 # Restore health after recovery
                 self.disaster_state = "Normal"
@@ -359,7 +384,7 @@ class BackupDashboard:
         threading.Thread(target=restore, daemon=True).start()
 
     def simulate_disaster(self, disaster_type):
-        """Simulate various disaster scenarios"""
+        """Simulate a disaster: drill its scenario on a copy of the sources and measure recovery"""
         self.disasters_handled_session += 1
         self.disaster_state = disaster_type
         self.log(f"🚨 SIMULATING DISASTER: {disaster_type}!", level="error")
@@ -367,24 +392,22 @@ class BackupDashboard:
 
         if disaster_type == "Server Crash":
             self.system_health = 0
-            self.log("System health dropped to 0%. Triggering emergency backup...")
-            self.run_backup() # Trigger emergency backup
+            self.log("System health dropped to 0%. Files cut short mid-write...")
         elif disaster_type == "Server Overload":
             self.system_health = 20
-            self.log("CPU 98%, Memory 95%. Triggering emergency backup...")
+            self.log("CPU 98%, Memory 95%. Files lost, damaged and cut short...")
             # Simulate high CPU/Mem usage for a short period
             self.cpu_progress["value"] = 98
             self.mem_progress["value"] = 95
-            self.run_backup()
         elif disaster_type == "Total Loss":
             self.system_health = 0
-            self.log("Complete system failure. Data might be lost. Triggering emergency backup (if possible)...")
-            self.run_backup()
+            self.log("Complete system failure. Sources and local backups destroyed...")
         elif disaster_type == "Data Corruption":
             self.system_health = 50
-            self.log("Database corruption detected. Triggering emergency backup...")
-            self.run_backup()
+            self.log("Silent data corruption detected...")
         
+        # The damage is done to a drill copy, never to the live sources
+        self.run_disaster_drill()
         self.refresh_dashboard()
 
     def emergency_recovery(self):
@@ -394,6 +417,11 @@ class BackupDashboard:
         
         def recover():
             backups = self.backup_system.list_backups()
+            from_cloud = False
+            if not backups:
+                # Local backups are gone too (e.g. Total Loss): fall back to the cloud copies
+                backups = self.cloud_simulator.list_backup_metadata()
+                from_cloud = bool(backups)
             if not backups:
                 self.log("No backups available for emergency recovery.", level="error")
                 messagebox.showerror("Error", "No backups available for emergency recovery.")
@@ -402,12 +430,51 @@ class BackupDashboard:
             
             latest_backup = backups[0]['backup_name']
             self.log(f"Automatically selecting latest backup: {latest_backup}")
-            self.restore_specific_backup(latest_backup)
+            # Corrupted data is repaired in place, hashing every file since silent corruption
+            # keeps size and mtime; other disasters restore a fresh copy
+            corruption = self.disaster_state == "Data Corruption"
+            self.restore_specific_backup(latest_backup, in_place=corruption, from_cloud=from_cloud,
+                                         checksum=corruption or None)
             self.log("✅ Emergency Recovery complete!")
             self.update_status("Recovery complete", '#2ECC71')
         
         threading.Thread(target=recover, daemon=True).start()
 
+    def run_disaster_drill(self):
+        """Drill the last simulated disaster on a copy of the sources and report RTO/RPO"""
+        scenario = DISASTER_SCENARIOS.get(self.disaster_state, "mixed")
+        self.log("=" * 60)
+        self.log(f"🧪 DISASTER DRILL: {scenario}")
+        self.log("=" * 60)
+        self.update_status(f"Running {scenario} drill...", '#1ABC9C')
+        
+        def drill():
+            passed, result = DisasterDrill(scenario).run()
+            if result is None:
+                self.log("❌ Drill could not run, see the log for details", level="error")
+                self.update_status("Drill failed", '#E74C3C')
+                return
+            self.log(f"Damage: {result['damage']} of {result['files']} files")
+            self.log(f"RTO: {result['rto_s']:.2f}s (target {result['rto_target_s']}s) - "
+                     f"restore {result['restore_s']:.2f}s, verify {result['verify_s']:.2f}s")
+            live = f", newest real backup {result['live_rpo_s']:.0f}s old" if result["live_rpo_s"] is not None else ""
+            self.log(f"RPO: {result['rpo_s']:.0f}s with the disaster {result['disaster_after_s']}s after the "
+                     f"backup{live} (target {result['rpo_target_s']}s), "
+                     f"{result['lost_files']} files lost since the backup")
+            self.log(f"Verified: {result['verified_files']}/{result['files']} files match the backup")
+            if result["trend"]["runs"]:
+                self.log(f"Trend: median RTO of last {result['trend']['runs']} runs "
+                         f"{result['trend']['median_rto_s']:.2f}s ({result['trend']['rto_change_pct']:+.1f}%)")
+            self.log_profile(result["restore_profile"])
+            if passed:
+                self.log("✅ Drill passed")
+                self.update_status(f"Drill passed: RTO {result['rto_s']:.1f}s", '#27AE60')
+            else:
+                self.log("❌ Drill failed its targets", level="error")
+                self.update_status(f"Drill FAILED: RTO {result['rto_s']:.1f}s", '#E74C3C')
+        
+        threading.Thread(target=drill, daemon=True).start()
+
     def toggle_auto_backup(self):
         """Toggle automated backup feature"""
         self.auto_backup_enabled = not self.auto_backup_enabled
@@ -0,0 +1,125 @@
+"""Backup pipeline benchmarks
+
+Measures the per-GB cost of each stage of the backup write pipeline so
+changes to it can be compared run to run:
+
+    python scripts/benchmark.py --size-mb 256
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent / "app"))
+
+from config import BACKUP_CONFIG, CLOUD_CONFIG, ENCRYPTION_CONFIG
+from encryption import BackupCipher
+import archive
+
+GB = 1024 ** 3
+
+
+def make_dataset(root, size_mb, file_mb=8):
+    """Write a semi-compressible synthetic dataset (half random, half text)"""
+    root.mkdir(parents=True, exist_ok=True)
+    text = b"timestamp=2025-10-25 level=INFO message=backup heartbeat ok\n" * 1024
+    remaining = size_mb * 1024 * 1024
+    index = 0
+    while remaining > 0:
+        size = min(file_mb * 1024 * 1024, remaining)
+        with open(root / f"file_{index:04d}.bin", 'wb') as f:
+            written = 0
+            while written < size:
+                block = os.urandom(32 * 1024) + text[:32 * 1024]
+                f.write(block[:size - written])
+                written += len(block)
+        remaining -= size
+        index += 1
+
+
+def per_gb(seconds, nbytes):
+    return seconds * GB / nbytes if nbytes else 0.0
+
+
+def bench_stages(data_dir, workers, chunk_size, level):
+    """Time compression and sealing of the same chunks separately"""
+    chunks = []
+    for path in sorted(data_dir.iterdir()):
+        with open(path, 'rb') as f:
+            chunks.extend(iter(lambda: f.read(chunk_size), b""))
+    total = sum(len(c) for c in chunks)
+    cipher = BackupCipher.generate(master_key=os.urandom(32))
+    prefix = os.urandom(archive.NONCE_PREFIX_SIZE)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        start = time.perf_counter()
+        compressed = list(executor.map(lambda c: archive.compress_chunk(c, level), chunks))
+        compress_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        list(executor.map(lambda ic: cipher.seal(prefix, ic[0], ic[1], "bench", False), enumerate(compressed)))
+        seal_s = time.perf_counter() - start
+
+    return {
+        "compress_s_per_gb": per_gb(compress_s, total),
+        "seal_s_per_gb": per_gb(seal_s, total),
+        "compression_ratio": sum(len(c) for c in compressed) / total,
+    }
+
+
+def bench_end_to_end(data_dir, work_dir, encrypted):
+    """Time a full create_backup run with encryption on or off"""
+    from backup import BackupSystem
+
+    backup_dir = work_dir / ("encrypted" if encrypted else "plain")
+    backup_dir.mkdir(parents=True, exist_ok=True)
+    BACKUP_CONFIG["source_dirs"] = [str(data_dir)]
+    BACKUP_CONFIG["backup_location"] = str(backup_dir)
+    CLOUD_CONFIG["local_storage_path"] = str(backup_dir)
+    # Keep the uploaded blobs and block cache inside the temp dir too, never in the real container
+    CLOUD_CONFIG["blob_storage_path"] = str(work_dir / "cloud_storage")
+    CLOUD_CONFIG["block_cache_path"] = str(work_dir / "cache" / "blocks")
+    ENCRYPTION_CONFIG["enabled"] = encrypted
+    ENCRYPTION_CONFIG["key_file"] = str(work_dir / "master.key")
+
+    start = time.perf_counter()
+    success, _, metadata = BackupSystem().create_backup()
+    elapsed = time.perf_counter() - start
+    if not success:
+        raise RuntimeError("Benchmark backup failed")
+    return per_gb(elapsed, metadata["total_size_bytes"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--size-mb", type=int, default=256, help="synthetic dataset size")
+    parser.add_argument("--workers", type=int, default=ENCRYPTION_CONFIG["workers"])
+    args = parser.parse_args()
+
+    chunk_size = ENCRYPTION_CONFIG["chunk_size_kb"] * 1024
+    level = ENCRYPTION_CONFIG["compression_level"]
+    with tempfile.TemporaryDirectory(prefix="backup-bench-") as tmp:
+        work_dir = Path(tmp)
+        data_dir = work_dir / "data"
+        print(f"📊 Generating {args.size_mb} MB dataset...")
+        make_dataset(data_dir, args.size_mb)
+
+        stages = bench_stages(data_dir, args.workers, chunk_size, level)
+        plain = bench_end_to_end(data_dir, work_dir, encrypted=False)
+        encrypted = bench_end_to_end(data_dir, work_dir, encrypted=True)
+
+    print("=" * 50)
+    print(f"Workers: {args.workers}  Chunk: {chunk_size // 1024} KB  Level: {level}")
+    print(f"Compression ratio:          {stages['compression_ratio']:.2f}")
+    print(f"Compress (parallel):        {stages['compress_s_per_gb']:.2f} s/GB")
+    print(f"AEAD seal (parallel):       {stages['seal_s_per_gb']:.2f} s/GB")
+    print(f"Seal / compress:            {stages['seal_s_per_gb'] / stages['compress_s_per_gb']:.1%}")
+    print(f"Backup, plain ZIP:          {plain:.2f} s/GB")
+    print(f"Backup, encrypted:          {encrypted:.2f} s/GB")
+
+
+if __name__ == "__main__":
+    main()
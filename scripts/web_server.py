@@ -1,13 +1,22 @@
-from flask import Flask, jsonify
+from flask import Flask, Response, jsonify, request, stream_with_context
 import sys
+import json
+import fnmatch
 from pathlib import Path
 
 sys.path.insert(0, str(Path(__file__).parent.parent / "app"))
 
 from backup import BackupSystem
+from restore import RestoreSystem
+from config import JOBS_CONFIG, RESTORE_CONFIG
+import jobs
+import metrics_sampler
+import profiler
 
 app = Flask(__name__)
 backup_system = BackupSystem()
+job_manager = jobs.JobManager()
+sampler = metrics_sampler.shared_sampler()
 
 @app.route("/health")
 def health_check():
@@ -18,15 +27,191 @@ def health_check():
 
 @app.route("/metrics")
 def metrics():
-    # In a real scenario, you would expose actual metrics here
-    # For now, we'll return some dummy data or basic stats
     backup_stats = backup_system.get_backup_stats()
     return jsonify({
         "total_backups": backup_stats["total_backups"],
         "total_size_mb": backup_stats["total_size_mb"],
         "latest_backup": backup_stats["latest_backup"],
-        "system_health": 100 # Placeholder
+        "system_health": sampler.health(),
+        "host": sampler.summary(request.args.get("window", type=float)),
+        "last_backup_profile": _profile_summary("backup"),
+        "last_restore_profile": _profile_summary("restore"),
     })
 
+@app.route("/metrics/history")
+def metrics_history():
+    """Sampled values of one host metric, e.g. ?field=source_busy_percent&seconds=600"""
+    field = request.args.get("field", "cpu_percent")
+    if field not in sampler.buffer.fields:
+        return jsonify({"error": f"Unknown field: {field}", "fields": list(sampler.buffer.fields)}), 400
+    seconds = request.args.get("seconds", type=float)
+    return jsonify({
+        "field": field,
+        "interval_s": sampler.interval_s,
+        "samples": [[t, value] for t, value in sampler.history(field, seconds)],
+        "percentiles": sampler.percentiles(field, seconds),
+    })
+
+def _profile_summary(run_type):
+    """Phase timings of the latest traced run, without the sampling details"""
+    summary = profiler.latest_summary(backup_system.backup_dir, run_type)
+    if summary is None:
+        return None
+    return {key: value for key, value in summary.items()
+            if key not in ("cprofile_top", "tracemalloc_top")}
+
+def _run_backup(progress, incremental=None):
+    # A system per job: runs never share tracer or profile state
+    system = BackupSystem()
+    success, backup_name, metadata = system.create_backup(incremental=incremental, progress=progress)
+    return success, {"backup_name": backup_name, "metadata": metadata, "profile": system.last_profile}
+
+def _run_synthesize(progress, backup_name=None):
+    system = BackupSystem()
+    success, new_name, metadata = system.synthesize_full_backup(backup_name, progress=progress)
+    return success, {"backup_name": new_name, "metadata": metadata, "profile": system.last_profile}
+
+def _run_restore(progress, backup_name, from_cloud=False, **options):
+    system = RestoreSystem()
+    restore = system.restore_from_cloud if from_cloud else system.restore_backup
+    success = restore(backup_name, progress=progress, **options)
+    return success, {"backup_name": backup_name, "profile": system.last_profile}
+
+def _queue(kind, fn, **params):
+    try:
+        job = job_manager.submit(kind, fn, **params)
+    except jobs.QueueFull as e:
+        return jsonify({"error": str(e)}), 429
+    return jsonify({
+        "job_id": job.id,
+        "status": job.status,
+        "status_url": f"/jobs/{job.id}",
+        "events_url": f"/jobs/{job.id}/events",
+    }), 202
+
+@app.route("/jobs/backup", methods=["POST"])
+def queue_backup():
+    body = request.get_json(silent=True) or {}
+    incremental = body.get("incremental")
+    if incremental is not None and not isinstance(incremental, bool):
+        return jsonify({"error": "incremental must be a boolean"}), 400
+    return _queue("backup", _run_backup, incremental=incremental)
+
+@app.route("/jobs/synthesize", methods=["POST"])
+def queue_synthesize():
+    body = request.get_json(silent=True) or {}
+    backup_name = body.get("backup_name")
+    if backup_name is not None:
+        if not _is_backup_name(backup_name):
+            return jsonify({"error": "backup_name must be a plain backup_*.zip file name"}), 400
+        if not _backup_committed(backup_name):
+            return jsonify({"error": f"Backup not found: {backup_name}"}), 404
+    return _queue("synthesize", _run_synthesize, backup_name=backup_name)
+
+@app.route("/jobs/restore", methods=["POST"])
+def queue_restore():
+    body = request.get_json(silent=True) or {}
+    backup_name = body.get("backup_name")
+    if not isinstance(backup_name, str) or not backup_name:
+        return jsonify({"error": "backup_name is required"}), 400
+    for key in ("from_cloud", "in_place", "delete_extras", "checksum"):
+        if body.get(key) is not None and not isinstance(body[key], bool):
+            return jsonify({"error": f"{key} must be a boolean"}), 400
+    paths = body.get("paths")
+    if paths is not None and (not isinstance(paths, list) or not paths
+                              or not all(isinstance(p, str) and p for p in paths)):
+        return jsonify({"error": "paths must be a non-empty list of strings"}), 400
+    restore_location = body.get("restore_location")
+    if restore_location is not None:
+        restore_location = _allowed_restore_location(restore_location)
+        if restore_location is None:
+            return jsonify({"error": "restore_location must be a directory below one of: "
+                                     + ", ".join(RESTORE_CONFIG["api_restore_roots"])}), 400
+    elif body.get("delete_extras"):
+        # Never let the API delete files from the live sources
+        return jsonify({"error": "delete_extras requires a restore_location"}), 400
+    if not _is_backup_name(backup_name):
+        return jsonify({"error": "backup_name must be a plain backup_*.zip file name"}), 400
+    from_cloud = body.get("from_cloud", False)
+    if not _backup_committed(backup_name, from_cloud):
+        return jsonify({"error": f"Backup not found: {backup_name}"}), 404
+    options = {key: body[key] for key in ("paths", "in_place", "delete_extras", "checksum")
+               if body.get(key) is not None}
+    if restore_location is not None:
+        options["restore_location"] = restore_location
+    options["from_cloud"] = from_cloud
+    return _queue("restore", _run_restore, backup_name=backup_name, **options)
+
+def _is_backup_name(name):
+    """A plain archive name inside the backup directory (no paths, no other files)"""
+    return (isinstance(name, str) and Path(name).name == name
+            and fnmatch.fnmatchcase(name, "backup_*.zip"))
+
+def _backup_committed(backup_name, from_cloud=False):
+    """The archive and its .meta exist: only committed backups are restored"""
+    if from_cloud:
+        cloud = backup_system.cloud
+        return cloud.blob_exists(backup_name) and cloud.blob_exists(f"{backup_name}.meta")
+    backup_path = backup_system.backup_dir / backup_name
+    return backup_path.is_file() and Path(f"{backup_path}.meta").is_file()
+
+def _allowed_restore_location(location):
+    """Resolved restore_location if it lies below an allowed root (relative paths: below the first)"""
+    if not isinstance(location, str) or not location:
+        return None
+    roots = [Path(root).resolve() for root in RESTORE_CONFIG["api_restore_roots"]]
+    if not roots:
+        return None
+    target = (roots[0] / location).resolve()
+    for root in roots:
+        if target != root and root in target.parents:
+            return str(target)
+    return None
+
+@app.route("/jobs")
+def list_jobs():
+    return jsonify([job.to_dict() for job in job_manager.list()])
+
+@app.route("/jobs/<job_id>")
+def job_status(job_id):
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict())
+
+@app.route("/jobs/<job_id>", methods=["DELETE"])
+@app.route("/jobs/<job_id>/cancel", methods=["POST"])
+def cancel_job(job_id):
+    job = job_manager.cancel(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+    return jsonify(job.to_dict()), 202
+
+@app.route("/jobs/<job_id>/events")
+def job_events(job_id):
+    """Server-sent events: a progress event whenever the job moves, then a final done event"""
+    job = job_manager.get(job_id)
+    if job is None:
+        return jsonify({"error": "Unknown job"}), 404
+
+    def stream():
+        last = None
+        while True:
+            finished = job.done.wait(JOBS_CONFIG["stream_interval_s"])
+            state = job.to_dict()
+            if finished:
+                yield f"event: done\ndata: {json.dumps(state)}\n\n"
+                return
+            current = (state["status"], state["progress"]["phase"], state["progress"]["bytes_done"],
+                       state["progress"]["files_done"])
+            if current != last:
+                last = current
+                yield f"event: progress\ndata: {json.dumps(state)}\n\n"
+            else:
+                yield ": keep-alive\n\n"
+
+    return Response(stream_with_context(stream()), mimetype="text/event-stream",
+                    headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+
 if __name__ == "__main__":
-    app.run(host="0.0.0.0", port=5000)
+    app.run(host="0.0.0.0", port=5000, threaded=True)